@@ -2,6 +2,15 @@
 
 from plater3d.slicers import cura5
 import argparse
+import itertools
+import mmap
+import os
+import sys
+from pathlib import Path
+
+# lines that start a block of settings in a CuraEngine log
+WARNING_MARKER = "[WARNING]  -s"
+ALL_MARKER = "All settings: "
 
 def clean_settings(settings):
     dup_allow = set() # settings for which duplicates don't mean override
@@ -43,7 +52,7 @@ def write_settings(settings, filename):
                 print(f"{k}=\"{v}\"", file=f)
 
 def read_settings_log(sf, firstline, markerpos, marker):
-    out = [firstline[p+len(marker)-2:].strip()]
+    out = [firstline[markerpos+len(marker)-2:].strip()]
 
     # every cura setting has a k="v" format in the log file
     in_str = out[-1][-1] != '"'
@@ -63,33 +72,104 @@ def read_settings_log(sf, firstline, markerpos, marker):
     #print("")
     return "".join(out)
 
+def read_block(lines):
+    """Settings text of the block that starts at the first of lines, or None."""
+
+    l = next(lines)
+    p = l.find(WARNING_MARKER)
+    if p != -1:
+        return read_settings_log(lines, l, p, WARNING_MARKER)
+
+    p = l.find(ALL_MARKER)
+    if p != -1:
+        return l[p+len(ALL_MARKER):]
+
+    return None
+
+def mmap_lines(mm, start):
+    # decode lines lazily from start, a block is usually a few lines
+    while start < len(mm):
+        end = mm.find(b"\n", start)
+        end = len(mm) if end == -1 else end + 1
+        yield mm[start:end].decode("utf-8", errors="replace")
+        start = end
+
+def block_starts_reverse(mm):
+    """Offsets of the lines starting settings blocks, most recent first,
+    found by searching backwards from the end of the file."""
+
+    markers = [WARNING_MARKER.encode(), ALL_MARKER.encode()]
+    found = [mm.rfind(m) for m in markers]
+    while True:
+        i = max(range(len(markers)), key=lambda i: found[i])
+        if found[i] == -1: return
+
+        start = mm.rfind(b"\n", 0, found[i]) + 1
+        yield start
+
+        # only search again for markers that were on or after this line
+        for j, m in enumerate(markers):
+            if found[j] >= start:
+                found[j] = mm.rfind(m, 0, start)
+
+def nth_last_block(logfile, n = 1):
+    """Text of the nth most recent settings block in logfile, or None."""
+
+    with open(logfile, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return None
+
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for i, start in enumerate(block_starts_reverse(mm), 1):
+                if i == n:
+                    return read_block(mmap_lines(mm, start))
+
+    return None
+
+def all_blocks(logfile):
+    """Yield the text of every settings block, oldest first, without
+    keeping earlier blocks in memory."""
+
+    with open(logfile, "r") as f:
+        for l in f:
+            if l.find(WARNING_MARKER) != -1 or l.find(ALL_MARKER) != -1:
+                # not a generator over f, which would close f when
+                # read_block drops it partway through
+                yield read_block(itertools.chain([l], f))
+
+def extract(config, text, output):
+    csettings = clean_settings(config._parse_cli(text))
+    write_settings(csettings, output)
+
 if __name__ == "__main__":
     p = argparse.ArgumentParser(description="Parse the CuraEngine output and extract settings actually used")
 
     p.add_argument("logfile", help="Log file (or output) of CuraEngine")
     p.add_argument("output", nargs="?", help="File to store settings in, suitable for diff_cura_settings, as well as -s of printplate")
+    p.add_argument("-n", dest="nth", type=int, default=1, help="Use the Nth most recent settings in the log (default: 1, the last)")
+    p.add_argument("--all", dest="alldir", metavar="DIR", help="Write every set of settings in the log to a separate file in DIR")
     args = p.parse_args()
 
-    settings = []
-    with open(args.logfile, "r") as f:
-        for l in f:
-            marker = "[WARNING]  -s"
-            p = l.find(marker)
-            if p != -1:
-                settings.append(read_settings_log(f, l, p, marker))
-            else:
-                p = l.find("All settings: ")
-                if p != -1:
-                    settings.append(l[p+len("All settings: "):])
+    config = cura5.CURA5Config(None, False)
+
+    if args.alldir:
+        outdir = Path(args.alldir)
+        outdir.mkdir(parents=True, exist_ok=True)
+        count = 0
+        for text in all_blocks(args.logfile):
+            out = outdir / f"settings.{count:04d}.txt"
+            extract(config, text, out)
+            count += 1
+
+        print(f"Wrote {count} settings files to {outdir}")
+        sys.exit(0 if count else 1)
 
-    if len(settings):
-        print(f"Found {len(settings)}, processing last one")
+    text = nth_last_block(args.logfile, args.nth)
+    if text is not None:
+        print(f"Found settings {args.nth} from the end of the log")
 
-        config = cura5.CURA5Config(None, False)
-        settings = config._parse_cli(settings[-1])
-        csettings = clean_settings(settings)
         if args.output:
-            write_settings(csettings, args.output)
+            extract(config, text, args.output)
             print(f"Wrote output to {args.output}")
     else:
         print("No settings found")
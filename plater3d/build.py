@@ -0,0 +1,125 @@
+import os
+import json
+import shutil
+import hashlib
+from pathlib import Path
+
+from .packcache import ENGINE_VERSION
+
+# Fingerprints of the inputs of each stage of a job
+#
+#   meshes, counts, ... --pack--> plates.json --print--> <job>.N.gcode
+#
+# are recorded in build.json in the job directory when the stage
+# completes, so later runs can tell which stages are out of date.
+
+def file_hash(filename):
+    h = hashlib.sha256()
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+
+    return h.hexdigest()
+
+def binary_stamp(binary):
+    # slicer binaries are large, so use size and mtime rather than a hash
+    fp = shutil.which(binary) or binary
+    if not os.path.exists(fp):
+        return [binary, None]
+
+    st = os.stat(fp)
+    return [str(Path(fp).resolve()), st.st_size, st.st_mtime_ns]
+
+def mesh_hashes(job, mesh_cache):
+    return dict([(f, mesh_cache.content_hash(f)) for f in job.stlfiles])
+
+def pack_inputs(job, options, volxyz, hashes):
+    return {'meshes': hashes,
+            'counts': dict(job.counts),
+            'groups': dict([(f, job.fileprops[f].get('group', None)) for f in job.stlfiles]),
+            'orientations': dict([(f, job.fileprops[f].get('orientation', {}).get('rotation', None))
+                                  for f in job.stlfiles]),
+            'options': options,
+            'volxyz': volxyz,
+            'engine': ENGINE_VERSION}
+
+def plate_inputs(job, plates, pno, hashes, settings_hash, slicer_stamp):
+    stlinfo = dict([(f['name'], f) for f in plates['stlinfo']['files']])
+    parts = plates['plates'][pno]['parts']
+    names = sorted(set(p['name'] for p in parts))
+
+    return {'parts': [[p['name'], p['index'], p['position'], p.get('rotz', 0)] for p in parts],
+            'placement': dict([(n, [stlinfo[n]['min_point'], stlinfo[n].get('rotation', None)])
+                               for n in names]),
+            'meshes': dict([(n, hashes.get(n, None)) for n in names]),
+            'unique': dict([(n, job.fileprops.get(n, {}).get('unique', None)) for n in names]),
+            'volxyz': plates['volxyz'],
+            'settings': settings_hash,
+            'machine': job.machine,
+            'extruders': job.extruders,
+            'slicer': [job.slicer, slicer_stamp]}
+
+def changes(old, new):
+    """Names of the inputs that differ between two fingerprints."""
+
+    if old is None:
+        return ['never built']
+
+    # compare as stored, e.g. tuples become lists
+    new = json.loads(json.dumps(new))
+
+    out = []
+    for k in sorted(set(old) | set(new)):
+        o = old.get(k, None)
+        n = new.get(k, None)
+        if o == n: continue
+
+        if isinstance(o, dict) and isinstance(n, dict):
+            out.extend([f"{k}: {Path(x).name}" for x in sorted(set(o) | set(n))
+                        if o.get(x, None) != n.get(x, None)])
+        else:
+            out.append(k)
+
+    return out
+
+class BuildState:
+    VERSION = 1
+
+    def __init__(self, job):
+        self.filename = job.root / 'build.json'
+        self.pack = None
+        self.pack_options = {}
+        self.plates = {}
+
+        if self.filename.exists():
+            with open(self.filename, "r") as f:
+                d = json.load(fp=f)
+
+            if d.get('version', 0) == BuildState.VERSION:
+                self.pack = d.get('pack', None)
+                self.pack_options = d.get('pack_options', {})
+                self.plates = d.get('plates', {})
+
+    def record_pack(self, inputs):
+        self.pack = inputs
+        self.pack_options = inputs['options']
+
+    def record_plate(self, pno, inputs):
+        self.plates[str(pno)] = inputs
+
+    def plate(self, pno):
+        return self.plates.get(str(pno), None)
+
+    def forget_plates(self, count):
+        # plates that no longer exist after a repack
+        for k in [k for k in self.plates if int(k) >= count]:
+            del self.plates[k]
+
+    def save(self):
+        tmp = self.filename.with_suffix(f'.{os.getpid()}.tmp')
+        with open(tmp, "w") as f:
+            json.dump({'version': BuildState.VERSION,
+                       'pack': self.pack,
+                       'pack_options': self.pack_options,
+                       'plates': self.plates}, fp=f, indent='  ')
+        os.replace(tmp, self.filename)
@@ -0,0 +1,171 @@
+import sys
+import time
+import sqlite3
+from pathlib import Path
+
+from .config import get_config_dir
+
+# A catalog of every job, kept in the config directory so that
+# questions about all jobs (parts left, unsliced plates, hours queued)
+# don't need every printjob.json, plates.json and G-code header to be
+# read again. pj3d updates it when a job is saved, packed or printed,
+# so it only knows about jobs that have been touched since it was added;
+# use scan to add older ones.
+
+SCHEMA = ["""CREATE TABLE jobs (path TEXT PRIMARY KEY, name TEXT, machine TEXT,
+                                print_settings TEXT, slicer TEXT, updated REAL, packed REAL)""",
+          """CREATE TABLE parts (job TEXT, stlfile TEXT, count INTEGER, done INTEGER, grp TEXT,
+                                 PRIMARY KEY (job, stlfile))""",
+          """CREATE TABLE plates (job TEXT, plate INTEGER, parts INTEGER, est_time REAL, est_filament REAL,
+                                  gcode TEXT, sliced REAL, time REAL, filament REAL,
+                                  PRIMARY KEY (job, plate))""",
+          """CREATE TABLE plate_parts (job TEXT, plate INTEGER, stlfile TEXT, count INTEGER)""",
+          "CREATE INDEX jobs_name ON jobs (name)",
+          "CREATE INDEX plate_parts_job ON plate_parts (job, plate)"]
+
+def job_key(filename):
+    return str(Path(filename).resolve())
+
+class Catalog:
+    VERSION = 1
+
+    def __init__(self, filename = None):
+        if filename is None:
+            filename = get_config_dir() / 'pj3d' / 'catalog.sqlite'
+
+        self.filename = Path(filename)
+        self.filename.parent.mkdir(parents=True, exist_ok=True)
+
+        # several pj3d commands (e.g. watch and done) may run at once
+        self.db = sqlite3.connect(str(self.filename), timeout=10)
+        self.db.row_factory = sqlite3.Row
+
+        if self.db.execute("PRAGMA user_version").fetchone()[0] != Catalog.VERSION:
+            with self.db:
+                for t in ['jobs', 'parts', 'plates', 'plate_parts']:
+                    self.db.execute(f"DROP TABLE IF EXISTS {t}")
+                for s in SCHEMA:
+                    self.db.execute(s)
+                self.db.execute(f"PRAGMA user_version = {Catalog.VERSION}")
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def record_job(self, job, filename):
+        key = job_key(filename)
+        with self.db:
+            self.db.execute("""INSERT INTO jobs (path, name, machine, print_settings, slicer, updated)
+                               VALUES (?, ?, ?, ?, ?, ?)
+                               ON CONFLICT (path) DO UPDATE SET name=excluded.name, machine=excluded.machine,
+                                 print_settings=excluded.print_settings, slicer=excluded.slicer,
+                                 updated=excluded.updated""",
+                            (key, job.name, job.machine, str(job.print_settings), job.slicer, time.time()))
+
+            self.db.execute("DELETE FROM parts WHERE job = ?", (key,))
+            self.db.executemany("INSERT INTO parts VALUES (?, ?, ?, ?, ?)",
+                                [(key, f, job.counts[f], job.done.get(f, 0),
+                                  job.fileprops.get(f, {}).get('group', None)) for f in job.stlfiles])
+
+    def record_plates(self, job, plates, estimates):
+        """Record a new packing, plates is a PlatesFile and estimates
+        a (time, filament) per plate."""
+
+        key = job_key(job.filename)
+        with self.db:
+            self.db.execute("UPDATE jobs SET packed = ? WHERE path = ?", (time.time(), key))
+            self.db.execute("DELETE FROM plates WHERE job = ?", (key,))
+            self.db.execute("DELETE FROM plate_parts WHERE job = ?", (key,))
+
+            for pno, (plate, (t, fil)) in enumerate(zip(plates.plates, estimates)):
+                counts = {}
+                for part in plate.parts:
+                    counts[part.name] = counts.get(part.name, 0) + 1
+
+                self.db.execute("INSERT INTO plates (job, plate, parts, est_time, est_filament) VALUES (?, ?, ?, ?, ?)",
+                                (key, pno, len(plate.parts), t, fil))
+                self.db.executemany("INSERT INTO plate_parts VALUES (?, ?, ?, ?)",
+                                    [(key, pno, n, c) for n, c in counts.items()])
+
+    def record_gcode(self, job, sliced):
+        """Record sliced plates, a list of (plate, gcode, time, filament)."""
+
+        key = job_key(job.filename)
+        with self.db:
+            self.db.executemany("""UPDATE plates SET gcode = ?, sliced = ?, time = ?, filament = ?
+                                   WHERE job = ? AND plate = ?""",
+                                [(str(gcode), Path(gcode).stat().st_mtime, t, fil, key, pno)
+                                 for pno, gcode, t, fil in sliced])
+
+    def prune(self):
+        """Forget jobs whose files no longer exist. Returns their names."""
+
+        gone = [(r['path'], r['name']) for r in self.db.execute("SELECT path, name FROM jobs")
+                if not Path(r['path']).exists()]
+
+        with self.db:
+            for key, _ in gone:
+                for t, col in [('jobs', 'path'), ('parts', 'job'), ('plates', 'job'), ('plate_parts', 'job')]:
+                    self.db.execute(f"DELETE FROM {t} WHERE {col} = ?", (key,))
+
+        return [n for _, n in gone]
+
+    def summary(self, pattern = '*'):
+        """Per job state for jobs whose names match pattern (a glob)."""
+
+        jobs = dict([(r['path'], {'name': r['name'], 'path': r['path'], 'machine': r['machine'],
+                                  'parts': 0, 'remaining': 0, 'plates': []})
+                     for r in self.db.execute("SELECT * FROM jobs WHERE name GLOB ? ORDER BY name, path",
+                                              (pattern,))])
+        if not jobs:
+            return []
+
+        where = "job IN (SELECT path FROM jobs WHERE name GLOB ?)"
+        keys = (pattern,)
+
+        done = {}
+        for r in self.db.execute(f"SELECT job, stlfile, count, done FROM parts WHERE {where}", keys):
+            jobs[r['job']]['parts'] += r['count']
+            jobs[r['job']]['remaining'] += max(r['count'] - r['done'], 0)
+            done[(r['job'], r['stlfile'])] = r['done']
+
+        plate_parts = {}
+        for r in self.db.execute(f"SELECT * FROM plate_parts WHERE {where} ORDER BY job, plate", keys):
+            plate_parts.setdefault((r['job'], r['plate']), []).append((r['stlfile'], r['count']))
+
+        for r in self.db.execute(f"SELECT * FROM plates WHERE {where} ORDER BY job, plate", keys):
+            # parts marked done are taken to be from the earliest plates,
+            # and parts that aren't in the job (purge lines) are ignored
+            parts = 0
+            left = 0
+            for f, c in plate_parts.get((r['job'], r['plate']), []):
+                if (r['job'], f) not in done: continue
+
+                d = min(done[(r['job'], f)], c)
+                done[(r['job'], f)] -= d
+                parts += c
+                left += c - d
+
+            t = r['time'] if r['time'] is not None else r['est_time']
+            jobs[r['job']]['plates'].append({'plate': r['plate'], 'parts': parts, 'left': left,
+                                             'sliced': r['gcode'] is not None,
+                                             'estimated': r['time'] is None,
+                                             'time': t,
+                                             'time_left': (t or 0) * left / parts if parts else 0})
+
+        return list(jobs.values())
+
+def update(method, *args):
+    """Call a Catalog method, warning instead of failing if the catalog
+    can't be updated."""
+
+    try:
+        with Catalog() as cat:
+            return getattr(cat, method)(*args)
+    except (sqlite3.Error, OSError) as e:
+        print(f"WARNING: Job catalog not updated: {e}", file=sys.stderr)
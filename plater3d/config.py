@@ -51,6 +51,15 @@ def get_config_dir():
 
     return Path(os.path.abspath(os.path.expanduser(path)))
 
+def get_cache_dir():
+    path = None
+    if platform.system() == 'Windows':
+        path = os.environ.get('LOCALAPPDATA', '') or '~/AppData/Local'
+    else:
+        path = os.environ.get('XDG_CACHE_HOME', '') or '~/.cache'
+
+    return Path(os.path.abspath(os.path.expanduser(path))) / 'pj3d'
+
 def get_appimage_default():
     s = platform.system()
     if s == 'Linux':
@@ -0,0 +1,192 @@
+import os
+import re
+import json
+import math
+from pathlib import Path
+
+import numpy as np
+
+from . import stl
+from .config import get_config_dir
+from .xform import Affine
+
+# Cura defaults for settings that the print settings file may leave out
+SETTING_DEFAULTS = {'layer_height': 0.2,
+                    'layer_height_0': 0.3,
+                    'line_width': 0.4,
+                    'wall_line_count': 2,
+                    'infill_sparse_density': 20,
+                    'speed_print': 60,
+                    'speed_infill': None,
+                    'speed_wall': None,
+                    'material_diameter': 1.75}
+
+TIME_FEATURES = ['shell_time', 'infill_time', 'layers', 'part_layers', 'plate']
+FILAMENT_FEATURES = ['shell_volume', 'infill_volume']
+
+# physically motivated starting point, used until enough slices are seen
+DEFAULT_TIME_COEF = [1.6, 1.2, 4.0, 0.5, 120.0]
+DEFAULT_FILAMENT_COEF = [1.0, 1.0]
+
+# fewer samples than this and the fit is not trusted
+MIN_SAMPLES = 8
+
+def print_settings(filename):
+    """Numeric settings relevant to the estimate, from a print settings file."""
+
+    from .slicers.cura5 import FileSettings
+
+    out = dict(SETTING_DEFAULTS)
+    if filename and Path(filename).exists():
+        for k, v in FileSettings(filename).items():
+            if k in out:
+                try:
+                    out[k] = float(v)
+                except ValueError:
+                    pass
+
+    if out['speed_infill'] is None: out['speed_infill'] = out['speed_print']
+    if out['speed_wall'] is None: out['speed_wall'] = out['speed_print'] / 2
+    return out
+
+def mesh_stats(filename, rotation = None):
+    tris = stl.read_stl(filename).astype(np.float64)
+    _, areas = stl.face_normals(tris)
+
+    # signed volume of the tetrahedra from the origin to each facet
+    volume = abs(np.einsum('ij,ij->i', tris[:, 0], np.cross(tris[:, 1], tris[:, 2])).sum() / 6)
+
+    v = tris.reshape(-1, 3)
+    if rotation is not None and any(rotation):
+        v = Affine.rotation(rotation).apply(v)
+
+    st = os.stat(filename)
+    return {'stamp': [st.st_mtime_ns, st.st_size, list(rotation or [0, 0, 0])],
+            'volume': float(volume),
+            'area': float(areas.sum()),
+            'height': float(v[:, 2].max() - v[:, 2].min())}
+
+def job_mesh_stats(job, filename, cache = True):
+    """Mesh statistics cached in the job's fileprops.
+
+    With cache False, stale statistics are recomputed but the job is
+    left unchanged."""
+
+    props = job.fileprops[filename]
+    rotation = props.get('orientation', {}).get('rotation', [0, 0, 0])
+    st = os.stat(filename)
+    ms = props.get('meshstats', None)
+    if ms is None or ms['stamp'] != [st.st_mtime_ns, st.st_size, list(rotation)]:
+        ms = mesh_stats(filename, rotation)
+        if cache: props['meshstats'] = ms
+
+    return ms
+
+def part_features(ms, settings):
+    lw = settings['line_width']
+    lh = settings['layer_height']
+
+    shell = min(ms['volume'], ms['area'] * settings['wall_line_count'] * lw)
+    infill = max(ms['volume'] - shell, 0) * settings['infill_sparse_density'] / 100
+    layers = math.ceil(max(ms['height'] - settings['layer_height_0'], 0) / lh) + 1
+
+    return {'shell_volume': shell,
+            'infill_volume': infill,
+            'shell_time': shell / (lw * lh * settings['speed_wall']),
+            'infill_time': infill / (lw * lh * settings['speed_infill']),
+            'layers': layers,
+            'part_layers': layers,
+            'plate': 0}
+
+def plate_features(parts):
+    """Combine features of the parts on a plate; parts is a list of feature dicts."""
+
+    out = dict([(k, 0.0) for k in TIME_FEATURES + FILAMENT_FEATURES])
+    for f in parts:
+        for k in ('shell_volume', 'infill_volume', 'shell_time', 'infill_time', 'part_layers'):
+            out[k] += f[k]
+        out['layers'] = max(out['layers'], f['layers'])
+
+    out['plate'] = 1
+    return out
+
+def read_gcode_stats(gcode_file, opener = open):
+    """Time (s) and filament (m) from a sliced file's header."""
+
+    time = None
+    filament = None
+    with opener(gcode_file, "r") as f:
+        for l in f:
+            if l[0] != ';': break
+            if l.startswith(';TIME:'):
+                time = float(l[6:])
+            elif l.startswith(';Filament used:'):
+                m = re.search(r'[0-9.]+', l[15:])
+                if m: filament = float(m.group(0))
+
+    return time, filament
+
+class Estimator:
+    """Linear model of print time and filament, fitted on sliced plates."""
+
+    def __init__(self, modelfile = None):
+        if modelfile is None:
+            modelfile = get_config_dir() / 'pj3d' / 'estimator.json'
+
+        self.modelfile = Path(modelfile)
+        self.samples = {}
+        self.time_coef = list(DEFAULT_TIME_COEF)
+        self.filament_coef = list(DEFAULT_FILAMENT_COEF)
+
+        if self.modelfile.exists():
+            with open(self.modelfile, "r") as f:
+                d = json.load(fp=f)
+            self.samples = d.get('samples', {})
+            self.time_coef = d.get('time_coef', self.time_coef)
+            self.filament_coef = d.get('filament_coef', self.filament_coef)
+
+    @property
+    def calibrated(self):
+        return len(self.samples) >= MIN_SAMPLES
+
+    def add_sample(self, key, features, time, filament_mm3):
+        self.samples[key] = {'features': features, 'time': time, 'filament': filament_mm3}
+
+    def fit(self):
+        if not self.calibrated:
+            return False
+
+        s = list(self.samples.values())
+        X = np.array([[x['features'][k] for k in TIME_FEATURES] for x in s])
+        y = np.array([x['time'] for x in s])
+        self.time_coef = [max(0.0, float(c)) for c in np.linalg.lstsq(X, y, rcond=None)[0]]
+
+        s = [x for x in s if x['filament'] is not None]
+        X = np.array([[x['features'][k] for k in FILAMENT_FEATURES] for x in s])
+        y = np.array([x['filament'] for x in s])
+        if len(s):
+            self.filament_coef = [max(0.0, float(c)) for c in np.linalg.lstsq(X, y, rcond=None)[0]]
+
+        return True
+
+    def save(self):
+        self.modelfile.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.modelfile, "w") as f:
+            json.dump({'version': 1,
+                       'time_coef': self.time_coef,
+                       'filament_coef': self.filament_coef,
+                       'samples': self.samples}, fp=f, indent='  ')
+
+    def time(self, features):
+        return sum(c * features[k] for c, k in zip(self.time_coef, TIME_FEATURES))
+
+    def filament_mm3(self, features):
+        return sum(c * features[k] for c, k in zip(self.filament_coef, FILAMENT_FEATURES))
+
+    def filament_m(self, features, settings):
+        d = settings['material_diameter']
+        return self.filament_mm3(features) / (math.pi * (d / 2) ** 2) / 1000
+
+def format_time(seconds):
+    seconds = int(round(seconds))
+    return f"{seconds // 3600}h{(seconds % 3600) // 60:02d}m"
@@ -0,0 +1,367 @@
+import os
+import re
+import math
+
+from .gcodeio import open_gcode
+
+# Reprint some objects of a plate from its sliced G-code.
+#
+# CuraEngine marks the moves of each object with ;MESH:<name> inside
+# every ;LAYER:. The segments of the selected objects are copied as
+# they are, and everything else that moves the head (travel between
+# objects, skirt, support, other objects) is dropped. The travel and
+# retraction needed to get from one copied segment to the next are
+# re-synthesized, with G92 E to make the copied absolute E values line
+# up, and the header statistics are recomputed.
+
+# Cura defaults, used if the file has no retraction or travel to copy
+DEFAULT_RETRACT = 6.5
+DEFAULT_RETRACT_F = 1500
+DEFAULT_TRAVEL_F = 9000
+
+# commands only copied from the sections of the selected objects
+MOTION = set(['G0', 'G1', 'G2', 'G3', 'G10', 'G11', 'G92', 'G28'])
+
+_word = re.compile(r'([A-Za-z])\s*([-+]?[0-9]*\.?[0-9]*)')
+
+def mesh_key(name):
+    """Name of an object as printer firmware and exclusion logs show it."""
+    return re.sub(r"[^A-Za-z0-9_]", "_", name).upper()
+
+def mesh_names(gcode_file):
+    """Names of the objects in a sliced file, in order of appearance."""
+
+    out = {}
+    with open_gcode(gcode_file) as f:
+        for l in f:
+            if l.startswith(';MESH:'):
+                n = l[6:].strip()
+                if n != 'NONMESH': out[n] = True
+
+    return list(out)
+
+def parse(line):
+    """Command and parameters of a G-code line, (None, {}) for comments."""
+
+    code = line.split(';', 1)[0].strip()
+    if not code:
+        return None, {}
+
+    words = code.split(None, 1)
+    params = {}
+    if len(words) > 1:
+        for k, v in _word.findall(words[1]):
+            try:
+                params[k.upper()] = float(v)
+            except ValueError:
+                params[k.upper()] = None
+
+    return words[0].upper(), params
+
+class MachineState:
+    """Position, extrusion and feedrate after each line of G-code, with
+    totals of the (acceleration-free) move time and filament used.
+
+    Filament used counts only moves that extrude, not retractions or the
+    moves that undo them."""
+
+    def __init__(self):
+        self.pos = [0.0, 0.0, 0.0]
+        self.e = 0.0
+        self.f = 0.0
+        self.relative = False
+        self.relative_e = False
+        self.m83 = False
+        self.retracted = False
+        self.firmware_retract = False
+
+        self.time = 0.0
+        self.filament = 0.0
+        self.extruded = 0.0
+        self.lo = [math.inf] * 3
+        self.hi = [-math.inf] * 3
+
+        # first retraction and travel seen, to copy in synthesized moves
+        self.retract = None
+        self.travel_f = None
+
+    def snapshot(self):
+        return {'pos': list(self.pos), 'e': self.e, 'f': self.f,
+                'relative_e': self.relative_e, 'retracted': self.retracted}
+
+    def update(self, line):
+        cmd, p = parse(line)
+        self.extruded = 0.0
+        if cmd is None: return
+
+        if cmd in ('G0', 'G1', 'G2', 'G3'):
+            if 'F' in p and p['F']: self.f = p['F']
+
+            new = list(self.pos)
+            for i, a in enumerate('XYZ'):
+                if p.get(a) is not None:
+                    new[i] = self.pos[i] + p[a] if self.relative else p[a]
+
+            de = 0.0
+            if p.get('E') is not None:
+                de = p['E'] if self.relative_e else p['E'] - self.e
+                self.e = self.e + p['E'] if self.relative_e else p['E']
+
+            dist = math.dist(self.pos, new)
+            if dist == 0 and de != 0:
+                # an E-only move is a retraction or its recovery
+                if de < 0:
+                    self.retracted = True
+                    if self.retract is None: self.retract = (-de, self.f)
+                else:
+                    self.retracted = False
+
+            if cmd == 'G0' and dist > 0 and 'F' in p and self.travel_f is None:
+                self.travel_f = p['F']
+
+            if self.f > 0:
+                self.time += max(dist, abs(de)) / (self.f / 60)
+
+            self.extruded = de if de > 0 and dist > 0 else 0.0
+            self.filament += self.extruded
+            if self.extruded:
+                for i in range(3):
+                    self.lo[i] = min(self.lo[i], new[i], self.pos[i])
+                    self.hi[i] = max(self.hi[i], new[i], self.pos[i])
+
+            self.pos = new
+        elif cmd == 'G92':
+            for i, a in enumerate('XYZ'):
+                if p.get(a) is not None: self.pos[i] = p[a]
+            if p.get('E') is not None: self.e = p['E']
+        elif cmd == 'G10':
+            self.retracted = True
+            self.firmware_retract = True
+        elif cmd == 'G11':
+            self.retracted = False
+        elif cmd == 'G28':
+            for i, a in enumerate('XYZ'):
+                if a in p or not any(x in p for x in 'XYZ'): self.pos[i] = 0.0
+        elif cmd == 'G90':
+            self.relative = False
+            self.relative_e = self.m83
+        elif cmd == 'G91':
+            self.relative = True
+            self.relative_e = True
+        elif cmd == 'M82':
+            self.m83 = self.relative_e = False
+        elif cmd == 'M83':
+            self.m83 = self.relative_e = True
+
+def motion_params(gcode_file):
+    """Retraction (length, feedrate) and travel feedrate used in a file."""
+
+    st = MachineState()
+    with open_gcode(gcode_file) as f:
+        for l in f:
+            st.update(l)
+            if st.retract is not None and st.travel_f is not None: break
+
+    return (st.retract or (DEFAULT_RETRACT, DEFAULT_RETRACT_F),
+            st.travel_f or DEFAULT_TRAVEL_F,
+            st.firmware_retract)
+
+class _Writer:
+    def __init__(self, f, retract, travel_f, firmware_retract, hop):
+        self.f = f
+        self.state = MachineState()
+        self.retract, self.retract_f = retract
+        self.travel_f = travel_f
+        self.firmware_retract = firmware_retract
+        self.hop = hop
+
+    def write(self, line):
+        self.f.write(line if line.endswith('\n') else line + '\n')
+        self.state.update(line)
+
+    def _e_move(self, de):
+        st = self.state
+        e = de if st.relative_e else st.e + de
+        self.write(f"G1 F{self.retract_f:g} E{e:.5f}")
+
+    def move_to(self, target, travel = True):
+        """Get from the current state to target, a snapshot of the source
+        file, so that the lines that followed it can be copied."""
+
+        st = self.state
+        if not st.retracted:
+            if self.firmware_retract:
+                self.write("G10")
+            else:
+                self._e_move(-self.retract)
+
+        if travel:
+            if st.relative: self.write("G90")
+
+            x, y, z = target['pos']
+            if self.hop > 0:
+                self.write(f"G0 F{self.travel_f:g} Z{st.pos[2] + self.hop:.3f}")
+            self.write(f"G0 F{self.travel_f:g} X{x:.3f} Y{y:.3f}")
+            self.write(f"G0 Z{z:.3f}")
+
+        if target['relative_e'] != st.relative_e:
+            self.write("M83" if target['relative_e'] else "M82")
+
+        if not target['retracted']:
+            if self.firmware_retract:
+                self.write("G11")
+            else:
+                self._e_move(self.retract)
+
+        if not target['relative_e']:
+            self.write(f"G92 E{target['e']:.5f}")
+
+        if target['f']:
+            self.write(f"G1 F{target['f']:g}")
+
+def _header_line(l, src, new):
+    # replace the values cura computed for the whole plate
+    if l.startswith(';TIME:'):
+        t = src.get('time', None)
+        if t is not None and new['source_estimate'] > 0:
+            return f";TIME:{int(round(t * new['estimate'] / new['source_estimate']))}\n"
+        return f";TIME:{int(round(new['estimate']))}\n"
+    elif l.startswith(';Filament used:'):
+        return f";Filament used: {new['filament'] / 1000:.5f}m\n"
+
+    m = re.match(r';(MIN|MAX)([XYZ]):', l)
+    if m:
+        v = (new['lo'] if m.group(1) == 'MIN' else new['hi'])['XYZ'.index(m.group(2))]
+        return f";{m.group(1)}{m.group(2)}:{round(v, 3)}\n"
+
+    return l
+
+def extract_objects(gcode_file, output, names, hop = 0.0):
+    """Write the objects in names from gcode_file to output.
+
+    Returns a dict of statistics of the new file."""
+
+    names = set(names)
+    retract, travel_f, firmware_retract = motion_params(gcode_file)
+
+    src = MachineState()
+    header = []
+    layers = 0
+    dropped = 0.0   # extrusion outside any object, e.g. skirt or support
+    found = set()
+    body = f"{output}.{os.getpid()}.tmp"
+
+    with open_gcode(gcode_file) as f, open(body, "w") as out:
+        w = _Writer(out, retract, travel_f, firmware_retract, hop)
+
+        section = 'header'
+        pending = []    # ;LAYER: and state changes, written with the first object of the layer
+        tail = []       # lines after the end of a layer, the end gcode if it was the last
+        arrive = None   # state to move to before the first move of an object
+
+        for l in f:
+            if section == 'header':
+                # stripped and packed files may have lost the line that
+                # ended the header
+                if l.startswith(';') and not l.startswith((';LAYER_COUNT:', ';LAYER:')):
+                    header.append(l)
+                    src.update(l)
+                    continue
+                section = 'prologue'
+
+            if l.startswith(';LAYER:'):
+                for t, _ in tail: _outside(t, pending, w)
+                tail = []
+                # a layer without any of the objects, keep only its state changes
+                for p in pending[1:]: w.write(p)
+                pending = [l]
+                section = None
+            elif section == 'prologue' or section == 'after':
+                if section == 'prologue':
+                    w.write(l)
+                else:
+                    tail.append((l, src.snapshot()))
+            elif l.startswith(';MESH:'):
+                section = l[6:].strip()
+                if section in names:
+                    if pending:
+                        for p in pending: w.write(p)
+                        layers += 1
+                        pending = []
+                    found.add(section)
+                    w.write(l)
+                    arrive = src.snapshot()
+            elif l.startswith(';TIME_ELAPSED:'):
+                # the end of the layer, and of any object section in it
+                if not pending:
+                    w.write(f";TIME_ELAPSED:{w.state.time:.6f}\n")
+                section = 'after'
+            elif section in names:
+                cmd, p = parse(l)
+                if arrive is not None and cmd in MOTION:
+                    if cmd == 'G0' and p.get('E') is None and ('X' in p or 'Y' in p):
+                        # the object's own travel to its first path, go there directly
+                        src.update(l)
+                        w.move_to(src.snapshot())
+                        arrive = None
+                        continue
+
+                    w.move_to(arrive)
+                    arrive = None
+
+                w.write(l)
+            else:
+                _outside(l, pending, w)
+                src.update(l)
+                if section is None or section == 'NONMESH':
+                    dropped += src.extruded
+                continue
+
+            src.update(l)
+
+        # the end gcode, copied from where the last layer left the machine
+        if any(parse(t)[0] is not None for t, _ in tail):
+            w.move_to(tail[0][1], travel = False)
+        for t, _ in tail: w.write(t)
+
+    st = w.state
+    new = {'estimate': st.time, 'source_estimate': src.time, 'filament': st.filament,
+           'lo': [0 if math.isinf(v) else v for v in st.lo],
+           'hi': [0 if math.isinf(v) else v for v in st.hi]}
+
+    source = {}
+    for l in header:
+        if l.startswith(';TIME:'):
+            source['time'] = float(l[6:])
+
+    scale = (source['time'] / src.time) if src.time > 0 and 'time' in source else 1.0
+
+    with open(output, "w") as out, open(body, "r") as f:
+        for l in header:
+            out.write(_header_line(l, source, new))
+
+        for l in f:
+            if l.startswith(';LAYER_COUNT:'):
+                l = f";LAYER_COUNT:{layers}\n"
+            elif l.startswith(';TIME_ELAPSED:'):
+                l = f";TIME_ELAPSED:{float(l[14:]) * scale:.6f}\n"
+            out.write(l)
+
+    os.unlink(body)
+
+    return {'objects': sorted(found),
+            'missing': sorted(names - found),
+            'layers': layers,
+            'time': st.time * scale,
+            'filament': st.filament / 1000,
+            'dropped_filament': dropped / 1000}
+
+def _outside(l, pending, w):
+    # keep temperature, fan, etc. changes from outside the copied sections
+    cmd, _ = parse(l)
+    if cmd is None or cmd in MOTION: return
+
+    if pending:
+        pending.append(l)
+    else:
+        w.write(l)
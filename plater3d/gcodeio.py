@@ -0,0 +1,297 @@
+import io
+import os
+import gzip
+from pathlib import Path
+
+# Encodings for finished G-code files. A plate's G-code is written by
+# the slicer and then, in one streaming pass with the header fixups,
+# stripped of comments, packed and/or compressed into
+#
+#   <prefix>.N.gcode[.mpk][.gz|.zst]
+#
+# open_gcode reads any of these as plain text, so the readers don't
+# need to know how a file was stored.
+
+COMPRESSORS = ['gzip', 'zstd']
+SUFFIXES = {'gzip': '.gz', 'zstd': '.zst'}
+MEATPACK_SUFFIX = '.mpk'
+
+# comments still used after printing: layer progress, object names
+# for cancelling and redo, and thumbnails
+KEEP_COMMENTS = (';LAYER:', ';LAYER_COUNT:', ';TIME_ELAPSED:', ';MESH:')
+
+def _zstd():
+    try:
+        import zstandard
+    except ImportError:
+        raise ValueError("zstd compression needs the zstandard package (pip install zstandard)")
+
+    return zstandard
+
+def check_compressor(compress):
+    """Raise ValueError if compress can't be used here."""
+
+    if compress is None: return
+    if compress not in COMPRESSORS:
+        raise ValueError(f"Unknown compression '{compress}'")
+    if compress == 'zstd':
+        _zstd()
+
+def variants(filename):
+    """All names a G-code file may have been stored under, plain first."""
+
+    filename = str(filename)
+    out = []
+    for mpk in ['', MEATPACK_SUFFIX]:
+        out.append(Path(filename + mpk))
+        for c in COMPRESSORS:
+            out.append(Path(filename + mpk + SUFFIXES[c]))
+
+    return out
+
+def find(filename):
+    """The stored version of filename (a .gcode name), or None."""
+
+    for v in variants(filename):
+        if v.exists(): return v
+
+    return None
+
+def base_name(filename):
+    """The .gcode name of a stored file."""
+
+    name = str(filename)
+    for s in list(SUFFIXES.values()) + [MEATPACK_SUFFIX]:
+        if name.endswith(s): name = name[:-len(s)]
+
+    return Path(name)
+
+def is_stored(filename):
+    """True if filename is a stored G-code file, and not a partial slice,
+    temporary file or backup."""
+
+    filename = Path(filename)
+    base = base_name(filename)
+    return (not filename.name.startswith('.') and base.suffix == '.gcode'
+            and filename in variants(base))
+
+def _compression(filename):
+    name = str(filename)
+    for c, s in SUFFIXES.items():
+        if name.endswith(s): return c
+
+    return None
+
+def _open_binary(filename, mode, compress = None):
+    c = compress or _compression(filename)
+    if c == 'gzip':
+        return gzip.open(filename, mode)
+    elif c == 'zstd':
+        zstandard = _zstd()
+        if 'r' in mode:
+            return zstandard.ZstdDecompressor().stream_reader(open(filename, "rb"), closefd=True)
+        else:
+            return zstandard.ZstdCompressor().stream_writer(open(filename, "wb"), closefd=True)
+
+    return open(filename, mode)
+
+def open_gcode(filename, mode = "r"):
+    """Open a stored G-code file as text, decoding it on the fly."""
+
+    binary = _open_binary(filename, mode.replace('t', '').replace('b', '') + 'b')
+    if MEATPACK_SUFFIX in Path(filename).suffixes:
+        if 'r' not in mode:
+            binary.close()
+            raise ValueError(f"Can't write MeatPack file {filename}, use encode")
+        binary = io.BufferedReader(MeatPackReader(binary))
+
+    return io.TextIOWrapper(binary, encoding="utf-8", errors="replace")
+
+def strip_comments(lines):
+    """Drop comments, except for the header, thumbnails and KEEP_COMMENTS."""
+
+    header = True
+    thumbnail = False
+    for l in lines:
+        if header:
+            if l.startswith(';'):
+                yield l
+                continue
+            header = False
+
+        if l.startswith('; thumbnail begin'):
+            thumbnail = True
+        if thumbnail:
+            if l.startswith('; thumbnail end'): thumbnail = False
+            yield l
+            continue
+
+        if l.startswith(KEEP_COMMENTS):
+            yield l
+            continue
+
+        p = l.find(';')
+        if p != -1:
+            l = l[:p].rstrip() + '\n'
+
+        if l.strip():
+            yield l
+
+# MeatPack (as in Marlin and Prusa firmware) packs the 15 most common
+# characters of G-code into 4 bits, two to a byte. A nibble of 0b1111
+# means that character follows in full after the packed byte.
+MEATPACK_CHARS = "0123456789. \nGX"
+MP_FULL = 0b1111
+MP_SIGNAL = b'\xff\xff'
+MP_ENABLE = 0xfb
+MP_DISABLE = 0xfa
+
+_mp_table = dict([(c, i) for i, c in enumerate(MEATPACK_CHARS[:MP_FULL])])
+
+def meatpack_line(line):
+    """Pack one line, which is stripped of comments as MeatPack requires."""
+
+    line = line.split(';', 1)[0].strip()
+    if not line:
+        return b''
+
+    # whole lines are sent at once, so pad to an even length
+    line += ' \n' if len(line) % 2 == 0 else '\n'
+    out = bytearray()
+    for a, b in zip(line[0::2], line[1::2]):
+        na = _mp_table.get(a, MP_FULL)
+        nb = _mp_table.get(b, MP_FULL)
+        out.append(na | (nb << 4))
+        if na == MP_FULL: out.extend(a.encode('ascii', errors='replace'))
+        if nb == MP_FULL: out.extend(b.encode('ascii', errors='replace'))
+
+    return bytes(out)
+
+class MeatPackReader(io.RawIOBase):
+    """Unpacks a MeatPack stream, including its enable/disable signals."""
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.packing = False
+        self._buf = b''
+        self._out = bytearray()
+        self._eof = False
+
+    def readable(self):
+        return True
+
+    def close(self):
+        if not self.closed: self.raw.close()
+        super().close()
+
+    def _fill(self):
+        data = self.raw.read(1 << 16)
+        if not data:
+            self._eof = True
+            return
+
+        buf = self._buf + data
+        out = self._out
+        i = 0
+        n = len(buf)
+        while i < n:
+            if buf[i] == 0xff and i + 1 < n and buf[i + 1] == 0xff:
+                if i + 2 >= n: break
+                cmd = buf[i + 2]
+                if cmd == MP_ENABLE: self.packing = True
+                elif cmd == MP_DISABLE: self.packing = False
+                i += 3
+            elif buf[i] == 0xff and i + 1 >= n:
+                break
+            elif not self.packing:
+                out.append(buf[i])
+                i += 1
+            else:
+                pk = buf[i]
+                need = 1 + ((pk & 0xf) == MP_FULL) + ((pk >> 4) == MP_FULL)
+                if i + need > n: break
+
+                j = i + 1
+                for nib in (pk & 0xf, pk >> 4):
+                    if nib == MP_FULL:
+                        out.append(buf[j])
+                        j += 1
+                    else:
+                        out.append(ord(MEATPACK_CHARS[nib]))
+                i = j
+
+        self._buf = buf[i:]
+
+    def readinto(self, b):
+        while not self._out and not self._eof:
+            self._fill()
+
+        n = min(len(b), len(self._out))
+        b[:n] = self._out[:n]
+        del self._out[:n]
+        return n
+
+def _write_meatpack(w, lines):
+    # the header and KEEP_COMMENTS lines stay readable, with packing
+    # switched off around them, everything else is packed
+    packing = False
+    header = True
+    for l in lines:
+        if l.startswith(';') and (header or l.startswith(KEEP_COMMENTS)):
+            if packing:
+                w.write(MP_SIGNAL + bytes([MP_DISABLE]))
+                packing = False
+            w.write(l.encode('utf-8'))
+            continue
+
+        header = False
+        data = meatpack_line(l)
+        if not data: continue
+
+        if not packing:
+            w.write(MP_SIGNAL + bytes([MP_ENABLE]))
+            packing = True
+        w.write(data)
+
+    if packing:
+        w.write(MP_SIGNAL + bytes([MP_DISABLE]))
+
+def encode(filename, compress = None, meatpack = False, strip = False, source = None, fixup = None):
+    """Store a plain G-code file encoded, in a single pass.
+
+    The G-code is read from source (default filename), which is then
+    removed, and fixup, a function of each line, is applied on the way,
+    so header fixups don't need a pass of their own.
+
+    Returns the name of the stored file. Other stored versions of the
+    same file are removed, so readers always find this one."""
+
+    filename = Path(filename)
+    source = filename if source is None else Path(source)
+    check_compressor(compress)
+
+    out = Path(str(filename) + (MEATPACK_SUFFIX if meatpack else '') +
+               (SUFFIXES[compress] if compress else ''))
+
+    if compress or meatpack or strip or fixup is not None:
+        tmp = out.with_name(out.name + f".{os.getpid()}.tmp")
+        with open(source, "r", encoding="utf-8", errors="replace") as f:
+            lines = f if fixup is None else map(fixup, f)
+            if strip: lines = strip_comments(lines)
+
+            with _open_binary(tmp, "wb", compress) as w:
+                if meatpack:
+                    _write_meatpack(w, lines)
+                else:
+                    for l in lines:
+                        w.write(l.encode('utf-8'))
+
+        os.replace(tmp, out)
+        if source != out: os.unlink(source)
+    elif source != out:
+        os.replace(source, out)
+
+    for v in variants(base_name(filename)):
+        if v != out and v.exists(): os.unlink(v)
+
+    return out
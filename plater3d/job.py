@@ -111,6 +111,35 @@ class PrintJob:
 
         self.done[stlfile] += count
 
+    def add_source(self, stlfile, job, count):
+        """Record that count copies of stlfile come from another job."""
+
+        self.fileprops[stlfile].setdefault('sources', []).append({'job': str(Path(job.filename).resolve()),
+                                                                  'name': job.name,
+                                                                  'count': count,
+                                                                  'done': 0})
+
+    def attribute_done(self, stlfile, count):
+        """Split count newly printed (or, if negative, unmarked) copies of
+        stlfile over its source jobs. Returns a list of (jobfile, count)."""
+
+        out = []
+        sources = self.fileprops.get(stlfile, {}).get('sources', [])
+        for src in (sources if count >= 0 else reversed(sources)):
+            if count == 0: break
+
+            if count > 0:
+                n = min(count, src['count'] - src['done'])
+            else:
+                n = -min(-count, src['done'])
+
+            if n != 0:
+                src['done'] += n
+                count -= n
+                out.append((src['job'], n))
+
+        return out
+
     def save(self, filename = None):
         if filename is None:
             filename = self.filename
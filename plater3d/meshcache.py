@@ -0,0 +1,156 @@
+import os
+import json
+import hashlib
+import logging
+from collections import OrderedDict
+from pathlib import Path
+
+from . import stl
+from .config import get_cache_dir
+
+logger = logging.getLogger(__name__)
+
+class MeshCache:
+    """Per-session cache of loaded meshes, keyed by file and mtime.
+
+    Meshes with more than max_faces faces are replaced by a decimated
+    copy, and least recently used meshes are dropped once the total
+    face count exceeds budget_faces."""
+
+    def __init__(self, max_faces = None, budget_faces = None):
+        self.max_faces = max_faces
+        self.budget_faces = budget_faces
+        self._meshes = OrderedDict()
+        self._faces = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, filename):
+        fn = Path(filename).resolve()
+        st = os.stat(fn)
+        return (str(fn), st.st_mtime_ns, st.st_size)
+
+    def _lod(self, mesh, filename):
+        if self.max_faces is None or len(mesh.faces) <= self.max_faces:
+            return mesh
+
+        try:
+            lod = mesh.simplify_quadric_decimation(face_count=self.max_faces)
+        except Exception as e:
+            # trimesh needs an optional backend for decimation
+            logger.warning(f"{filename}: Unable to decimate {len(mesh.faces)} faces ({e}), using full mesh")
+            return mesh
+
+        logger.info(f"{filename}: Decimated {len(mesh.faces)} to {len(lod.faces)} faces")
+        return lod
+
+    def get(self, filename):
+        import trimesh
+
+        key = self._key(filename)
+        if key in self._meshes:
+            self.hits += 1
+            self._meshes.move_to_end(key)
+            return self._meshes[key]
+
+        self.misses += 1
+        mesh = self._lod(trimesh.load(filename, force='mesh'), filename)
+
+        # a newer mtime makes older entries for the same file unreachable
+        for k in [k for k in self._meshes if k[0] == key[0]]:
+            self._evict(k)
+
+        self._meshes[key] = mesh
+        self._faces += len(mesh.faces)
+
+        if self.budget_faces is not None:
+            while self._faces > self.budget_faces and len(self._meshes) > 1:
+                self._evict(next(iter(self._meshes)))
+
+        return mesh
+
+    def _evict(self, key):
+        self._faces -= len(self._meshes[key].faces)
+        del self._meshes[key]
+
+    def __len__(self):
+        return len(self._meshes)
+
+class NormalizedMeshCache:
+    """On-disk cache of meshes converted to compact binary STL.
+
+    Entries are keyed by the content hash of the source mesh and the
+    normalization options, so every job that uses a file shares the
+    conversion. The hash of a file is remembered by path, mtime and size
+    to avoid rehashing unchanged files."""
+
+    VERSION = 1
+
+    def __init__(self, cachedir = None, repair = True, tolerance = None):
+        if cachedir is None:
+            cachedir = get_cache_dir() / 'meshes'
+
+        self.cachedir = Path(cachedir)
+        self.cachedir.mkdir(parents=True, exist_ok=True)
+        self.repair = repair
+        self.tolerance = tolerance
+
+        self._indexfile = self.cachedir / 'index.json'
+        self._index = {}
+        if self._indexfile.exists():
+            with open(self._indexfile, "r") as f:
+                self._index = json.load(fp=f)
+
+        self._dirty = False
+
+    def content_hash(self, filename):
+        fn = Path(filename).resolve()
+        st = os.stat(fn)
+        stamp = [st.st_mtime_ns, st.st_size]
+
+        e = self._index.get(str(fn))
+        if e and e['stamp'] == stamp:
+            return e['sha256']
+
+        h = hashlib.sha256()
+        with open(fn, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                h.update(chunk)
+
+        self._index[str(fn)] = {'stamp': stamp, 'sha256': h.hexdigest()}
+        self._dirty = True
+        return h.hexdigest()
+
+    def _options(self):
+        return f"v{self.VERSION}-r{int(self.repair)}-t{self.tolerance or 0}"
+
+    def get(self, filename):
+        """Return the path of the normalized copy of filename, creating it if needed."""
+
+        out = self.cachedir / f"{self.content_hash(filename)}-{self._options()}.stl"
+        if out.exists():
+            return out
+
+        tris = stl.read_stl(filename)
+        ntris = len(tris)
+        if self.repair:
+            tris = stl.repair(tris)
+
+        if self.tolerance:
+            tris = stl.decimate(tris, self.tolerance)
+
+        logger.info(f"{filename}: normalized {ntris} facets to {len(tris)} in {out}")
+
+        # write under a temporary name so concurrent users never see a partial file
+        tmp = out.with_suffix(f'.{os.getpid()}.tmp')
+        stl.write_binary_stl(tmp, tris)
+        os.replace(tmp, out)
+        return out
+
+    def save(self):
+        if self._dirty:
+            tmp = self._indexfile.with_suffix(f'.{os.getpid()}.tmp')
+            with open(tmp, "w") as f:
+                json.dump(self._index, fp=f, indent='  ')
+            os.replace(tmp, self._indexfile)
+            self._dirty = False
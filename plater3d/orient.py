@@ -0,0 +1,159 @@
+import os
+import math
+
+import numpy as np
+
+from . import stl
+from .xform import Rotation3D, Affine
+
+# weights for the terms of the orientation score, all terms are normalized
+DEFAULT_WEIGHTS = {'overhang': 1.0, 'height': 0.5, 'footprint': 0.1, 'contact': 0.3}
+
+# memory for rotated vertices and their temporaries in score_rotations,
+# each vertex of each rotation needs about 40 bytes
+CHUNK_BYTES = 64 * 1024 * 1024
+
+def _axis_candidates():
+    # one rotation per face of a cube pointing down; rotz does not change
+    # height, support or contact
+    return [(0, 0, 0), (90, 0, 0), (180, 0, 0), (270, 0, 0), (0, 90, 0), (0, 270, 0)]
+
+def _face_down(n):
+    # rotx, roty (rotz = 0) that take the unit normal n to (0, 0, -1)
+    rx = math.degrees(math.atan2(n[1], n[2]))
+    r = math.hypot(n[1], n[2])
+    ry = 180 - math.degrees(math.atan2(n[0], r))
+    return (round(rx % 360, 3), round(ry % 360, 3), 0)
+
+def candidate_rotations(normals, areas, flat = 8):
+    """Axis-aligned rotations plus rotations that put each of the largest
+    flat regions of the mesh on the bed."""
+
+    cands = _axis_candidates()
+
+    # cluster facets by (rounded) normal and keep the largest clusters
+    key = np.round(normals, 2)
+    uniq, inv = np.unique(key, axis=0, return_inverse=True)
+    total = np.bincount(inv.ravel(), weights=areas)
+    for i in np.argsort(total)[::-1][:flat]:
+        n = uniq[i] / (np.linalg.norm(uniq[i]) or 1)
+        c = _face_down(n)
+        if c not in cands:
+            cands.append(c)
+
+    return cands
+
+def score_rotations(tris, rotations, support_angle = 50, weights = None, contact_tol = 0.1):
+    """Score every rotation of the mesh, lower is better.
+
+    Returns a dict of arrays, one entry per rotation."""
+
+    if weights is None:
+        weights = DEFAULT_WEIGHTS
+
+    R = Rotation3D.batch(rotations)
+    normals, areas = stl.face_normals(tris.astype(np.float64))
+    total_area = areas.sum() or 1
+
+    verts = tris.reshape(-1, 3).astype(np.float64)
+    out = {k: np.zeros(len(R)) for k in ['height', 'footprint', 'overhang', 'contact']}
+
+    # rotate in chunks to bound memory on dense meshes
+    chunk = max(1, CHUNK_BYTES // (40 * max(len(verts), 1)))
+    for i in range(0, len(R), chunk):
+        Rc = R[i:i+chunk]
+        rv = np.einsum('rij,vj->rvi', Rc, verts)
+        lo = rv.min(axis=1)
+        hi = rv.max(axis=1)
+        out['height'][i:i+chunk] = hi[:, 2] - lo[:, 2]
+        out['footprint'][i:i+chunk] = (hi[:, 0] - lo[:, 0]) * (hi[:, 1] - lo[:, 1])
+
+        nz = np.einsum('rj,fj->rf', Rc[:, 2, :], normals)
+        fz = rv[:, :, 2].reshape(len(Rc), -1, 3).max(axis=2)
+        on_bed = fz <= lo[:, 2:3] + contact_tol
+        down = nz < -math.sin(math.radians(support_angle))
+
+        out['contact'][i:i+chunk] = ((nz < -0.996) & on_bed) @ areas
+        out['overhang'][i:i+chunk] = (down & ~on_bed) @ areas
+
+    size = max(out['height'].max(), 1e-6)
+    out['score'] = (weights['overhang'] * out['overhang'] / total_area +
+                    weights['height'] * out['height'] / size +
+                    weights['footprint'] * out['footprint'] / (size * size) -
+                    weights['contact'] * out['contact'] / total_area)
+
+    return out
+
+def file_stamp(filename):
+    st = os.stat(filename)
+    return [st.st_mtime_ns, st.st_size]
+
+def best_orientation(filename, support_angle = 50, weights = None):
+    tris = stl.read_stl(filename)
+    normals, areas = stl.face_normals(tris.astype(np.float64))
+    rotations = candidate_rotations(normals, areas)
+    s = score_rotations(tris, rotations, support_angle, weights)
+
+    # keep the orientation the file came with unless another is clearly better
+    best = int(np.argmin(s['score']))
+    if s['score'][0] - s['score'][best] < 1e-3:
+        best = 0
+
+    return {'rotation': list(rotations[best]),
+            'height': round(float(s['height'][best]), 3),
+            'overhang': round(float(s['overhang'][best]), 3),
+            'contact': round(float(s['contact'][best]), 3),
+            'overhang_original': round(float(s['overhang'][0]), 3),
+            'height_original': round(float(s['height'][0]), 3),
+            'support_angle': support_angle,
+            'stamp': file_stamp(filename)}
+
+def convex_hull(points):
+    """Monotone chain convex hull of 2D points, counter-clockwise."""
+
+    pts = np.unique(np.round(points, 3), axis=0)
+    if len(pts) < 3:
+        return pts
+
+    def half(pts):
+        h = []
+        for p in pts:
+            while len(h) >= 2 and ((h[-1][0]-h[-2][0])*(p[1]-h[-2][1]) -
+                                   (h[-1][1]-h[-2][1])*(p[0]-h[-2][0])) <= 0:
+                h.pop()
+            h.append(p)
+        return h
+
+    lower = half(pts)
+    upper = half(pts[::-1])
+    return np.array(lower[:-1] + upper[:-1])
+
+def oriented_info(filename, rotation):
+    """stlinfo-style bounds and footprint of a mesh after rotation."""
+
+    verts = stl.read_stl(filename).reshape(-1, 3).astype(np.float64)
+    rv = Affine.rotation(rotation).apply(verts)
+    lo = rv.min(axis=0)
+    hi = rv.max(axis=0)
+
+    return {'min_point': [float(x) for x in lo],
+            'max_point': [float(x) for x in hi],
+            'dimensions': [float(x) for x in hi - lo],
+            'poly2d': convex_hull(rv[:, :2]).tolist(),
+            'rotation': list(rotation)}
+
+def is_stale(orientation, filename):
+    return orientation.get('stamp') != file_stamp(filename)
+
+def apply_orientations(stlinfo, fileprops):
+    """Replace the bounds and footprints in stlinfo with those of the
+    oriented meshes, recording the rotation for the slicer."""
+
+    for m in stlinfo['files']:
+        o = fileprops.get(m['name'], {}).get('orientation', None)
+        if o is None or not any(o['rotation']):
+            continue
+
+        m.update(oriented_info(m['name'], o['rotation']))
+
+    return stlinfo
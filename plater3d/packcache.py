@@ -0,0 +1,102 @@
+import os
+import json
+import hashlib
+import logging
+from pathlib import Path
+
+from .config import get_cache_dir
+
+logger = logging.getLogger(__name__)
+
+# bump whenever a change to the packer changes its results
+ENGINE_VERSION = 1
+
+def canonical_order(rects):
+    """Order rectangles so that identical multisets of sizes give identical
+    lists, whatever the part names are."""
+
+    return sorted(rects, key=lambda r: (r.x, r.y, r.key))
+
+def sizes(rects):
+    return [[r.x, r.y] for r in rects]
+
+class PackingCache:
+    """On-disk cache of packings, shared by all jobs.
+
+    Entries are keyed by a hash of the rectangle sizes and the packer
+    parameters. Parts are stored as slots into the canonical order of the
+    rectangles, so a hit can be mapped onto different part names."""
+
+    def __init__(self, cachedir = None):
+        if cachedir is None:
+            cachedir = get_cache_dir() / 'packings'
+
+        self.cachedir = Path(cachedir)
+        self.cachedir.mkdir(parents=True, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(kind, params, data):
+        s = json.dumps({'kind': kind, 'engine': ENGINE_VERSION,
+                        'params': params, 'data': data},
+                       sort_keys=True, separators=(',', ':'))
+        return hashlib.sha256(s.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        fn = self.cachedir / f"{key}.json"
+        try:
+            with open(fn, "r") as f:
+                out = json.load(fp=f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return out
+
+    def put(self, key, value):
+        fn = self.cachedir / f"{key}.json"
+        tmp = fn.with_suffix(f'.{os.getpid()}.tmp')
+        with open(tmp, "w") as f:
+            json.dump(value, fp=f)
+        os.replace(tmp, fn)
+
+def to_slots(plates, rects, keep_group = False):
+    """Replace part names in plates with their slot in rects. Parts not in
+    rects (e.g. purge lines) are kept as they are."""
+
+    slot = dict([(r.key, i) for i, r in enumerate(rects)])
+    out = []
+    for plate in plates:
+        parts = []
+        for p in plate['parts']:
+            key = (p['name'], p['index'])
+            sp = {'slot': slot[key]} if key in slot else {'name': p['name'], 'index': p['index']}
+            sp['position'] = p['position']
+            if keep_group or key not in slot:
+                sp['group'] = p['group']
+            if p.get('rotz', 0):
+                sp['rotz'] = p['rotz']
+            parts.append(sp)
+
+        out.append({'parts': parts, 'bounds': plate['bounds']})
+
+    return out
+
+def from_slots(plates, rects, groupno = None):
+    out = []
+    for plate in plates:
+        parts = []
+        for sp in plate['parts']:
+            name, index = rects[sp['slot']].key if 'slot' in sp else (sp['name'], sp['index'])
+            p = {'name': name, 'index': index,
+                 'group': sp['group'] if 'group' in sp else groupno,
+                 'position': list(sp['position'])}
+            if sp.get('rotz', 0):
+                p['rotz'] = sp['rotz']
+            parts.append(p)
+
+        out.append({'parts': parts, 'bounds': list(plate['bounds'])})
+
+    return out
@@ -0,0 +1,136 @@
+import math
+import json
+import time
+from contextlib import contextmanager
+
+class StageTimer:
+    """Accumulates wall-clock time spent in named stages."""
+
+    def __init__(self):
+        self.stages = {}
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start
+
+    def to_dict(self):
+        return dict([(k, round(v, 6)) for k, v in self.stages.items()])
+
+def _polygon_area(poly):
+    x = [p[0] for p in poly]
+    y = [p[1] for p in poly]
+    return abs(sum(x[i] * y[i-1] - x[i-1] * y[i] for i in range(len(poly)))) / 2
+
+def footprint_area(stlinfo, w, h):
+    # the 2D footprint if stlinfo has one, otherwise the packed rectangle
+    poly = stlinfo.get('poly2d', None)
+    if poly and isinstance(poly[0][0], (int, float)) and len(poly) >= 3:
+        return min(_polygon_area(poly), w * h)
+
+    return w * h
+
+def lower_bound(rects, usable):
+    """Simple lower bound on plates for (w, h) rectangles (including borders)."""
+
+    if not rects: return 0
+
+    area = math.ceil(sum(w * h for w, h in rects) / (usable[0] * usable[1]))
+
+    # no two of these fit side by side in either direction
+    large = sum(1 for w, h in rects if w > usable[0] / 2 and h > usable[1] / 2)
+
+    return max(area, large)
+
+def compute_report(plate_output, border, plateborder, timings = None, exclude = ()):
+    volxyz = plate_output['volxyz']
+    stlinfo = dict([(f['name'], f) for f in plate_output['stlinfo']['files']])
+    usable = (volxyz[0] - 2 * plateborder, volxyz[1] - 2 * plateborder)
+    usable_area = usable[0] * usable[1]
+
+    plates = []
+    groups = {}
+    total_area = 0
+    for pno, plate in enumerate(plate_output['plates']):
+        area = 0
+        heights = []
+        for part in plate['parts']:
+            if part['name'] in exclude: continue
+            si = stlinfo[part['name']]
+            x, y, w, h = part['position']
+            area += footprint_area(si, w, h)
+            heights.append(si['dimensions'][2])
+            groups.setdefault(part['group'], []).append((w + 2 * border, h + 2 * border))
+
+        b = plate['bounds']
+        bbox = (b[2] - b[0]) * (b[3] - b[1])
+        total_area += area
+
+        order = plate.get('order', {})
+        plates.append({'plate': pno,
+                       'parts': len(plate['parts']),
+                       'area': round(area, 2),
+                       'area_utilization': round(area / usable_area, 4),
+                       'bbox_utilization': round(area / bbox, 4) if bbox else 0,
+                       'min_height': round(min(heights), 2) if heights else 0,
+                       'max_height': round(max(heights), 2) if heights else 0,
+                       'height_spread': round(max(heights) - min(heights), 2) if heights else 0,
+                       'travel': order.get('travel', None),
+                       'packed_travel': order.get('packed_travel', None)})
+
+    allrects = [r for g in groups.values() for r in g]
+    lb = lower_bound(allrects, usable)
+    # groups are never mixed, so each needs its own plates
+    lb_groups = sum(lower_bound(g, usable) for g in groups.values())
+    nplates = len(plates)
+    ordered = [p for p in plates if p['travel'] is not None]
+
+    return {'version': 1,
+            'volxyz': volxyz,
+            'border': border,
+            'plateborder': plateborder,
+            'plates': plates,
+            'job': {'plates': nplates,
+                    'parts': sum(p['parts'] for p in plates),
+                    'groups': len(groups),
+                    'area_utilization': round(total_area / (usable_area * nplates), 4) if nplates else 0,
+                    'lower_bound': lb,
+                    'lower_bound_groups': lb_groups,
+                    'gap': nplates - lb,
+                    'gap_groups': nplates - lb_groups,
+                    'travel': round(sum(p['travel'] for p in ordered), 1) if ordered else None,
+                    'packed_travel': round(sum(p['packed_travel'] for p in ordered), 1) if ordered else None},
+            'timings': timings or {}}
+
+def save_report(report, filename):
+    with open(filename, "w") as f:
+        json.dump(report, fp=f, indent='  ')
+
+def load_report(filename):
+    with open(filename, "r") as f:
+        return json.load(fp=f)
+
+def summarize(report):
+    j = report['job']
+    out = [f"{j['plates']} plates for {j['parts']} parts in {j['groups']} groups, "
+           f"{j['area_utilization']*100:.1f}% of the bed used on average."]
+
+    out.append(f"Lower bound: {j['lower_bound']} plates ({j['lower_bound_groups']} keeping groups apart), "
+               f"gap {j['gap']} ({j['gap_groups']}).")
+
+    for p in report['plates']:
+        out.append(f"  Plate #{p['plate']}: {p['parts']} parts, area {p['area_utilization']*100:.1f}%, "
+                   f"bbox {p['bbox_utilization']*100:.1f}%, height {p['min_height']}-{p['max_height']}mm")
+
+    if j.get('travel') is not None:
+        saved = j['packed_travel'] - j['travel']
+        out.append(f"Print order: {j['travel']:.0f}mm of travel between parts, "
+                   f"{saved:.0f}mm ({saved / j['packed_travel'] * 100 if j['packed_travel'] else 0:.0f}%) less than packing order.")
+
+    if report['timings']:
+        out.append("Time: " + ", ".join([f"{k} {v*1000:.1f}ms" for k, v in report['timings'].items()]))
+
+    return "\n".join(out)
@@ -3,17 +3,24 @@
 import json
 
 class Part:
-    def __init__(self, name, index, group, position):
+    def __init__(self, name, index, group, position, rotz = 0):
         self.name = name
         self.index = index
         self.group = group
         self.position = position
+        # turn about z given by the packer, in degrees
+        self.rotz = rotz
 
     def to_dict(self):
-        return {'name': self.name,
-                'index': self.index,
-                'group': self.group,
-                'position': self.position}
+        out = {'name': self.name,
+               'index': self.index,
+               'group': self.group,
+               'position': self.position}
+
+        if self.rotz:
+            out['rotz'] = self.rotz
+
+        return out
 
     @property
     def key(self):
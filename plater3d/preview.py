@@ -0,0 +1,284 @@
+import os
+import zlib
+import shutil
+import struct
+import base64
+import colorsys
+import hashlib
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from .meshcache import MeshCache
+from .gcodeio import open_gcode
+from .xform import PlateCoords
+
+BED_COLOR = (230, 230, 230)
+BORDER_COLOR = (200, 200, 200)
+BG_COLOR = (255, 255, 255)
+
+# one per worker process, so plates rendered by the same worker share meshes
+_mesh_cache = MeshCache(budget_faces = 5000000)
+
+def part_color(name):
+    # stable colour per file, so copies of a part look the same across plates
+    h = int(hashlib.md5(name.encode('utf-8')).hexdigest()[:8], 16)
+    r, g, b = colorsys.hsv_to_rgb((h % 360) / 360.0, 0.65, 0.85)
+    return (int(r*255), int(g*255), int(b*255))
+
+def _polygons(poly2d):
+    # poly2d is either a single ring of [x, y] points or a list of rings
+    if not poly2d:
+        return []
+
+    if isinstance(poly2d[0][0], (int, float)):
+        return [np.asarray(poly2d, dtype=float)]
+
+    return [np.asarray(p, dtype=float) for p in poly2d if len(p) >= 3]
+
+def plate_footprints(plate, stlinfo, coords):
+    """Return (name, index, [polygons], height) for every part on a plate,
+    with polygons in plate coordinates."""
+
+    out = []
+    for obj in plate['parts']:
+        si = stlinfo[obj['name']]
+        x, y, w, h = obj['position']
+        polys = _polygons(si.get('poly2d', None))
+
+        if polys:
+            # poly2d is already rotated, so only translate and apply any turn from the packer
+            min_point, _ = coords.placement(si, obj)
+            xf = coords.mesh_to_plate(min_point, obj['position'], (0, 0, obj.get('rotz', 0)))
+            polys = xf.apply_polygons([p[:, :2] for p in polys])
+        else:
+            polys = [np.array([[x, y], [x+w, y], [x+w, y+h], [x, y+h]], dtype=float)]
+
+        out.append((obj['name'], obj['index'], polys, si['dimensions'][2]))
+
+    return out
+
+class Canvas:
+    def __init__(self, volxyz, scale, plateborder = 0):
+        self.volxyz = volxyz
+        self.scale = scale
+        self.width = max(1, int(round(volxyz[0] * scale)))
+        self.height = max(1, int(round(volxyz[1] * scale)))
+
+        self.rgb = np.empty((self.height, self.width, 3), dtype=np.uint8)
+        self.rgb[:, :] = BORDER_COLOR if plateborder else BED_COLOR
+        if plateborder:
+            pb = int(round(plateborder * scale))
+            self.rgb[pb:self.height-pb, pb:self.width-pb] = BED_COLOR
+
+        # plate coordinates of pixel centres, row 0 is the back of the plate
+        self.px = (np.arange(self.width) + 0.5) / scale
+        self.py = volxyz[1] - (np.arange(self.height) + 0.5) / scale
+
+    def _window(self, xmin, ymin, xmax, ymax):
+        c0 = max(0, int(np.floor(xmin * self.scale)))
+        c1 = min(self.width, int(np.ceil(xmax * self.scale)))
+        r0 = max(0, int(np.floor((self.volxyz[1] - ymax) * self.scale)))
+        r1 = min(self.height, int(np.ceil((self.volxyz[1] - ymin) * self.scale)))
+        return r0, r1, c0, c1
+
+    def fill_polygon(self, poly, color):
+        r0, r1, c0, c1 = self._window(*poly.min(axis=0), *poly.max(axis=0))
+        if r0 >= r1 or c0 >= c1: return
+
+        X, Y = np.meshgrid(self.px[c0:c1], self.py[r0:r1])
+        X = X[..., None]
+        Y = Y[..., None]
+
+        # even-odd crossing test against every edge at once
+        x1, y1 = poly[:, 0], poly[:, 1]
+        x2, y2 = np.roll(x1, -1), np.roll(y1, -1)
+        straddle = (y1 > Y) != (y2 > Y)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            xint = x1 + (Y - y1) * (x2 - x1) / (y2 - y1)
+        inside = np.count_nonzero(straddle & (X < xint), axis=2) % 2 == 1
+
+        self.rgb[r0:r1, c0:c1][inside] = color
+
+    def fill_heightmap(self, points, zmax, color):
+        # points are (N, 3) samples of the part surface in plate coordinates
+        cols = np.floor(points[:, 0] * self.scale).astype(int)
+        rows = np.floor((self.volxyz[1] - points[:, 1]) * self.scale).astype(int)
+        ok = (cols >= 0) & (cols < self.width) & (rows >= 0) & (rows < self.height)
+        cols, rows, z = cols[ok], rows[ok], points[ok, 2]
+
+        hmap = np.full((self.height, self.width), -np.inf)
+        np.maximum.at(hmap, (rows, cols), z)
+        mask = np.isfinite(hmap)
+
+        shade = 0.45 + 0.55 * np.clip(hmap[mask] / max(zmax, 1e-6), 0, 1)
+        self.rgb[mask] = (np.array(color)[None, :] * shade[:, None]).astype(np.uint8)
+
+def _surface_samples(vertices, faces, step):
+    # sample each triangle densely enough that no pixel is skipped,
+    # bucketing triangles by sample density to stay vectorized
+    tri = vertices[faces]
+    edge = np.max(np.linalg.norm(tri - np.roll(tri, 1, axis=1), axis=2), axis=1)
+    n = np.clip(np.ceil(edge / step), 1, 1024).astype(int)
+    n = 2 ** np.ceil(np.log2(n)).astype(int)
+
+    out = [vertices]
+    for k in np.unique(n):
+        t = tri[n == k]
+        i, j = np.meshgrid(np.arange(k+1), np.arange(k+1))
+        keep = (i + j) <= k
+        a = (i[keep] / k)[None, :, None]
+        b = (j[keep] / k)[None, :, None]
+        p = t[:, None, 0] + a * (t[:, None, 1] - t[:, None, 0]) + b * (t[:, None, 2] - t[:, None, 0])
+        out.append(p.reshape(-1, 3))
+
+    return np.concatenate(out)
+
+def render_plate(packing, pno, scale, modelpath = '.', use_mesh = False, plateborder = 0):
+    volxyz = packing['volxyz']
+    stlinfo = dict([(i['name'], i) for i in packing['stlinfo']['files']])
+    plate = packing['plates'][pno]
+
+    canvas = Canvas(volxyz, scale, plateborder)
+    coords = PlateCoords(volxyz)
+    fp = plate_footprints(plate, stlinfo, coords)
+
+    if use_mesh:
+        meshes = {}
+        for obj in plate['parts']:
+            si = stlinfo[obj['name']]
+            xf = coords.part_to_plate(si, obj)
+            key = (obj['name'], obj.get('rotz', 0))
+            if key not in meshes:
+                m = _mesh_cache.get(Path(modelpath) / obj['name'])
+                # sample once in the rotated frame, then only translate per copy
+                v = xf.linear @ np.asarray(m.vertices).T
+                meshes[key] = _surface_samples(v.T, np.asarray(m.faces), 0.5 / scale)
+
+            canvas.fill_heightmap(meshes[key] + xf.offset, volxyz[2],
+                                  part_color(obj['name']))
+    else:
+        for name, index, polys, height in fp:
+            for poly in polys:
+                canvas.fill_polygon(poly, part_color(name))
+
+    return canvas.rgb, plate_svg(fp, volxyz, plateborder)
+
+def plate_svg(footprints, volxyz, plateborder = 0):
+    w, h = volxyz[0], volxyz[1]
+    out = [f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {w} {h}" width="{w}mm" height="{h}mm">',
+           f'<rect x="0" y="0" width="{w}" height="{h}" fill="rgb{BORDER_COLOR if plateborder else BED_COLOR}"/>']
+
+    if plateborder:
+        out.append(f'<rect x="{plateborder}" y="{plateborder}" width="{w-2*plateborder}" '
+                   f'height="{h-2*plateborder}" fill="rgb{BED_COLOR}"/>')
+
+    for name, index, polys, height in footprints:
+        color = part_color(name)
+        for poly in polys:
+            pts = " ".join([f"{x:.2f},{h-y:.2f}" for x, y in poly])
+            out.append(f'<polygon points="{pts}" fill="rgb{color}" stroke="black" stroke-width="0.2">'
+                       f'<title>{Path(name).name}#{index} ({height:.1f}mm)</title></polygon>')
+
+    out.append('</svg>')
+    return "\n".join(out)
+
+def png_bytes(rgb):
+    h, w, _ = rgb.shape
+    raw = b''.join([b'\x00' + rgb[r].tobytes() for r in range(h)])
+
+    def chunk(ty, data):
+        c = ty + data
+        return struct.pack('>I', len(data)) + c + struct.pack('>I', zlib.crc32(c) & 0xffffffff)
+
+    return (b'\x89PNG\r\n\x1a\n' +
+            chunk(b'IHDR', struct.pack('>IIBBBBB', w, h, 8, 2, 0, 0, 0)) +
+            chunk(b'IDAT', zlib.compress(raw, 9)) +
+            chunk(b'IEND', b''))
+
+def thumbnail(rgb, size):
+    # nearest-neighbour downsample into a size x size letterboxed square
+    h, w, _ = rgb.shape
+    f = max(h, w) / size
+    th, tw = max(1, int(h / f)), max(1, int(w / f))
+    rows = np.minimum((np.arange(th) * f).astype(int), h - 1)
+    cols = np.minimum((np.arange(tw) * f).astype(int), w - 1)
+
+    out = np.empty((size, size, 3), dtype=np.uint8)
+    out[:, :] = BG_COLOR
+    r0, c0 = (size - th) // 2, (size - tw) // 2
+    out[r0:r0+th, c0:c0+tw] = rgb[rows][:, cols]
+    return out
+
+def contact_sheet(images, cols = 4, gap = 4):
+    if not images: return None
+
+    h = max(i.shape[0] for i in images)
+    w = max(i.shape[1] for i in images)
+    cols = min(cols, len(images))
+    rows = (len(images) + cols - 1) // cols
+
+    sheet = np.empty((rows * (h + gap) + gap, cols * (w + gap) + gap, 3), dtype=np.uint8)
+    sheet[:, :] = BG_COLOR
+    for i, img in enumerate(images):
+        r, c = divmod(i, cols)
+        y, x = gap + r * (h + gap), gap + c * (w + gap)
+        sheet[y:y+img.shape[0], x:x+img.shape[1]] = img
+
+    return sheet
+
+def gcode_thumbnail_block(png, w, h):
+    # format understood by PrusaSlicer, Klipper/Moonraker and OctoPrint
+    b64 = base64.b64encode(png).decode('ascii')
+    out = ['', ';', f'; thumbnail begin {w}x{h} {len(b64)}']
+    for i in range(0, len(b64), 78):
+        out.append(f'; {b64[i:i+78]}')
+    out.extend(['; thumbnail end', ';', ''])
+    return "\n".join(out)
+
+def embed_thumbnail(gcode_file, png, w, h):
+    # goes after the header comments so header readers stop before it;
+    # the G-code is streamed to a file next to it that then replaces it
+    gcode_file = Path(gcode_file)
+    tmp = gcode_file.with_name(f".{os.getpid()}.{gcode_file.name}")
+
+    try:
+        with open_gcode(gcode_file) as f, open_gcode(tmp, "w") as out:
+            l = f.readline()
+            while l.startswith(';'):
+                out.write(l)
+                l = f.readline()
+
+            # replace a thumbnail embedded by an earlier run
+            ahead = [l, f.readline(), f.readline()]
+            if ahead[:2] == ['\n', ';\n'] and ahead[2].startswith('; thumbnail begin'):
+                l = ahead[2]
+                while l and not l.startswith('; thumbnail end'):
+                    l = f.readline()
+                f.readline()
+                ahead = []
+
+            out.write(gcode_thumbnail_block(png, w, h))
+            out.writelines(ahead)
+            shutil.copyfileobj(f, out)
+
+        os.replace(tmp, gcode_file)
+    finally:
+        if tmp.exists(): tmp.unlink()
+
+def _render_job(args):
+    packing, pno, scale, modelpath, use_mesh, plateborder, thumbsize = args
+    rgb, svg = render_plate(packing, pno, scale, modelpath, use_mesh, plateborder)
+    thumb = thumbnail(rgb, thumbsize)
+    return pno, rgb, svg, thumb
+
+def render_plates(packing, plates, scale = 2.0, modelpath = '.', use_mesh = False,
+                  plateborder = 0, thumbsize = 300, jobs = None):
+    work = [(packing, pno, scale, modelpath, use_mesh, plateborder, thumbsize) for pno in plates]
+
+    if jobs == 1 or len(work) <= 1:
+        yield from map(_render_job, work)
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as ex:
+            yield from ex.map(_render_job, work)
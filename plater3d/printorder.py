@@ -0,0 +1,190 @@
+import math
+from collections import namedtuple
+
+# The order of the parts of a plate in plates.json is the order in
+# which meshes are given to the slicer. This orders them to shorten
+# the travel between parts, which matters most when printing one at a
+# time: a nearest-neighbour tour over the part centres, improved with
+# 2-opt.
+#
+# When printing one at a time, the head must not hit parts that are
+# already printed. Head gives the extent of the print head (with fans)
+# from the nozzle, in mm. A part may only be printed after another if
+# the other part is outside the area swept by the head while printing
+# it, so some pairs of parts must be printed in a fixed order.
+
+Head = namedtuple('Head', 'left right front back')
+
+# where the head starts, the front left corner of the bed
+START = (0, 0)
+
+def parse_head(s):
+    """Head from 'left,right,front,back' (or one value for all sides)."""
+
+    v = [float(x) for x in s.split(',')]
+    if len(v) == 1: v = v * 4
+    if len(v) != 4:
+        raise ValueError(f"Expected 1 or 4 values for head size, got '{s}'")
+
+    return Head(*v)
+
+def head_from_polygon(polygon):
+    """Head from a machine_head_with_fans_polygon setting.
+
+    Cura and printers disagree on the direction of y, so the larger of
+    front and back is used for both."""
+
+    xs = [p[0] for p in polygon]
+    ys = [p[1] for p in polygon]
+    y = max(abs(min(ys)), abs(max(ys)))
+    return Head(abs(min(xs)), abs(max(xs)), y, y)
+
+def centre(part):
+    x, y, w, h = part['position']
+    return (x + w / 2, y + h / 2)
+
+def path_length(points, order, start = START):
+    if not order: return 0
+
+    d = math.dist(start, points[order[0]])
+    for a, b in zip(order, order[1:]):
+        d += math.dist(points[a], points[b])
+
+    return d
+
+def _overlaps(a, b):
+    return a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]
+
+def precedence(parts, head):
+    """For each part, the set of parts that must be printed before it.
+
+    Returns (before, conflicts), where conflicts are pairs of parts
+    that can't be printed one at a time in either order."""
+
+    fp = []
+    swept = []
+    for p in parts:
+        x, y, w, h = p['position']
+        fp.append((x, y, x + w, y + h))
+        swept.append((x - head.left, y - head.front, x + w + head.right, y + h + head.back))
+
+    before = [set() for p in parts]
+    conflicts = []
+    for i in range(len(parts)):
+        for j in range(i + 1, len(parts)):
+            i_first = not _overlaps(fp[i], swept[j])  # j can be printed after i
+            j_first = not _overlaps(fp[j], swept[i])
+
+            if not i_first and not j_first:
+                conflicts.append((i, j))
+            elif not i_first:
+                before[i].add(j)
+            elif not j_first:
+                before[j].add(i)
+
+    return before, conflicts
+
+def _valid(order, before):
+    seen = set()
+    for i in order:
+        if not before[i] <= seen: return False
+        seen.add(i)
+
+    return True
+
+def nearest_neighbour(points, before, first = (), start = START):
+    order = list(first)
+    left = set(range(len(points))) - set(order)
+    here = points[order[-1]] if order else start
+
+    while left:
+        ready = [i for i in left if before[i] <= set(order)]
+        if not ready:
+            # cyclic constraints, take the rest as they come
+            ready = list(left)
+
+        nxt = min(ready, key=lambda i: (math.dist(here, points[i]), i))
+        order.append(nxt)
+        left.remove(nxt)
+        here = points[nxt]
+
+    return order
+
+def two_opt(points, order, before, fixed = 0, start = START, max_passes = 50):
+    """Reverse parts of order while that shortens it, keeping the first
+    fixed parts in place and respecting before."""
+
+    order = list(order)
+    n = len(order)
+    constrained = any(before)
+
+    def pt(k):
+        return start if k < 0 else points[order[k]]
+
+    for _ in range(max_passes):
+        improved = False
+        for i in range(fixed, n - 1):
+            for k in range(i + 1, n):
+                delta = (math.dist(pt(i - 1), pt(k)) - math.dist(pt(i - 1), pt(i)))
+                if k + 1 < n:
+                    delta += math.dist(pt(i), pt(k + 1)) - math.dist(pt(k), pt(k + 1))
+
+                if delta < -1e-9:
+                    new = order[:i] + order[i:k+1][::-1] + order[k+1:]
+                    if constrained and not _valid(new, before): continue
+                    order = new
+                    improved = True
+
+        if not improved: break
+
+    return order
+
+def order_plate(plate, heights = None, head = None, gantry = None, first = ()):
+    """Reorder the parts of a plate in place to shorten travel.
+
+    head (a Head) is given when printing one at a time. Parts whose
+    names are in first (e.g. purge lines) are printed before the rest,
+    in their current order. Returns a dict describing the order, which
+    is also stored in the plate."""
+
+    parts = plate['parts']
+    points = [centre(p) for p in parts]
+    packed = list(range(len(parts)))
+    fixed = [i for i, p in enumerate(parts) if p['name'] in first]
+
+    warnings = []
+    sequential = head is not None
+    before = [set() for p in parts]
+
+    if sequential and gantry is not None and heights is not None:
+        tall = [p['name'] for p, z in zip(parts, heights) if z > gantry]
+        if tall:
+            warnings.append(f"{len(tall)} parts are taller than the gantry ({gantry}mm), "
+                            f"the slicer will print all at once")
+            sequential = False
+
+    if sequential:
+        before, conflicts = precedence(parts, head)
+        if conflicts:
+            warnings.append(f"{len(conflicts)} pairs of parts are too close to print one at a time")
+
+    for i in fixed: before[i] = set()
+
+    order = nearest_neighbour(points, before, fixed)
+    order = two_opt(points, order, before, fixed = len(fixed))
+
+    if sequential and not _valid(order, before):
+        warnings.append("No order avoids the print head, keeping packing order")
+        order = packed
+    elif path_length(points, packed) < path_length(points, order) and _valid(packed, before):
+        order = packed
+
+    plate['parts'] = [parts[i] for i in order]
+    info = {'travel': round(path_length(points, order), 1),
+            'packed_travel': round(path_length(points, packed), 1),
+            'sequential': sequential}
+    if warnings:
+        info['warnings'] = warnings
+
+    plate['order'] = info
+    return info
@@ -0,0 +1,218 @@
+import asyncio
+import logging
+import re
+import sys
+import time
+
+logger = logging.getLogger(__name__)
+
+# CuraEngine logs all settings on one line, which can be very long
+STREAM_LIMIT = 64 * 1024 * 1024
+
+HEADER_START = 'Gcode header after slicing:'
+HEADER_END = 'End of gcode header.'
+
+# Approximate share of slicing time spent in each CuraEngine stage,
+# mirrors the weights CuraEngine uses for its own overall progress
+STAGES = [('start', 0.0), ('slice', 0.1), ('layerparts', 0.05),
+          ('inset+skin', 0.25), ('support', 0.1), ('export', 0.5),
+          ('process', 0.0), ('finish', 0.0)]
+
+# CuraEngine 5.x: "Progress: inset+skin = 5/10 30.1%"
+progress_re = re.compile(r'Progress:\s*(?P<stage>[\w+]+)\s*=\s*(?P<n>\d+)/(?P<max>\d+)\s+(?P<pct>[0-9.]+)%')
+# older: "Progress:inset+skin:5:10 \t0.301"
+progress_old_re = re.compile(r'Progress:(?P<stage>[\w+]+):(?P<n>\d+):(?P<max>\d+)\s+(?P<frac>[0-9.]+)')
+# "Progress: slice accomplished in 1.234s"
+stage_done_re = re.compile(r'Progress:\s*(?P<stage>[\w+]+) accomplished in')
+
+class EngineRun:
+    """State of a single streamed CuraEngine invocation."""
+
+    def __init__(self, name = ''):
+        self.name = name
+        self.header = []
+        self.progress = 0.0
+        self.stage = 'start'
+        self.started = None
+        self.finished = None
+        self.returncode = None
+        self.attempts = 0
+        self.status = 'queued'
+        self._in_header = False
+        self._header_pos = -1
+
+    def _stage_start(self, stage):
+        total = 0.0
+        for s, w in STAGES:
+            if s == stage: break
+            total += w
+        return total
+
+    def _stage_weight(self, stage):
+        return dict(STAGES).get(stage, 0.0)
+
+    def feed(self, l):
+        """Update state from one line of engine output."""
+
+        if not self._in_header:
+            # 5.3 has log lines starting with [
+            pos = l.find(HEADER_START)
+            if pos != -1:
+                self._in_header = True
+                self._header_pos = pos
+                self.header = []
+                return
+        else:
+            if l.startswith(HEADER_END) or (self._header_pos > 0 and l.startswith('[')):
+                self._in_header = False
+            else:
+                self.header.append(l)
+                return
+
+        m = progress_re.search(l)
+        if m:
+            self.stage = m.group('stage')
+            self.progress = max(self.progress, float(m.group('pct')) / 100.0)
+            return
+
+        m = progress_old_re.search(l)
+        if m:
+            self.stage = m.group('stage')
+            self.progress = max(self.progress, float(m.group('frac')))
+            return
+
+        m = stage_done_re.search(l)
+        if m:
+            stage = m.group('stage')
+            self.progress = max(self.progress, self._stage_start(stage) + self._stage_weight(stage))
+            self.stage = stage
+
+    def eta(self):
+        if self.started is None or self.progress <= 0.01 or self.finished is not None:
+            return None
+
+        elapsed = time.monotonic() - self.started
+        return elapsed * (1 - self.progress) / self.progress
+
+    def describe(self):
+        if self.status == 'running':
+            eta = self.eta()
+            eta = f"ETA {int(eta)//60}:{int(eta)%60:02d}" if eta is not None else "ETA --:--"
+            retry = f" (attempt {self.attempts})" if self.attempts > 1 else ""
+            return f"{self.name}: {self.progress*100:5.1f}% {self.stage:<12} {eta}{retry}"
+        elif self.status == 'done':
+            return f"{self.name}: done in {self.finished - self.started:.1f}s"
+        else:
+            return f"{self.name}: {self.status}"
+
+class EngineFailed(Exception):
+    def __init__(self, run):
+        super().__init__(f"{run.name}: slicer {run.status}, returncode {run.returncode}")
+        self.run = run
+
+def crashed(returncode):
+    # killed by a signal (negative on POSIX) or an abort/segfault exit code
+    return returncode < 0 or returncode in (134, 139)
+
+async def _stream(proc, run, logfile, on_line):
+    while True:
+        l = await proc.stdout.readline()
+        if not l: break
+
+        l = l.decode('utf-8', errors='replace')
+        if logfile is not None:
+            logfile.write(l)
+
+        run.feed(l)
+        if on_line is not None:
+            on_line(run, l)
+
+async def run_engine(cmd, env = None, logfile = None, run = None, timeout = None,
+                     retries = 0, on_line = None):
+    """Run the slicer, streaming its output through run.feed.
+
+    Retries up to retries times if the engine crashes. Raises EngineFailed
+    on a timeout or failure."""
+
+    if run is None:
+        run = EngineRun(str(cmd[-1]))
+
+    while True:
+        run.attempts += 1
+        run.progress = 0.0
+        run.stage = 'start'
+        run.status = 'running'
+        run.started = time.monotonic()
+
+        proc = await asyncio.create_subprocess_exec(*cmd, env=env,
+                                                    stdout=asyncio.subprocess.PIPE,
+                                                    stderr=asyncio.subprocess.STDOUT,
+                                                    limit=STREAM_LIMIT)
+        try:
+            await asyncio.wait_for(_stream(proc, run, logfile, on_line), timeout)
+            run.returncode = await proc.wait()
+        except asyncio.TimeoutError:
+            proc.kill()
+            run.returncode = await proc.wait()
+            run.status = 'timed out'
+            raise EngineFailed(run)
+        except asyncio.CancelledError:
+            proc.kill()
+            await proc.wait()
+            run.status = 'cancelled'
+            raise
+
+        if run.returncode == 0:
+            run.status = 'done'
+            run.progress = 1.0
+            run.finished = time.monotonic()
+            return run
+
+        if crashed(run.returncode) and run.attempts <= retries:
+            logger.warning(f"{run.name}: slicer crashed (returncode {run.returncode}), retrying")
+            continue
+
+        run.status = 'failed'
+        raise EngineFailed(run)
+
+class ProgressView:
+    """Live view of several runs on a terminal, one line per run."""
+
+    def __init__(self, runs, out = sys.stderr, interval = 0.5, what = 'plates'):
+        self.runs = runs
+        self.what = what
+        self.out = out
+        self.interval = interval
+        self.tty = out.isatty()
+        self._lines = 0
+        self._last = {}
+
+    def draw(self):
+        lines = [r.describe() for r in self.runs if r.status not in ('queued', 'done')]
+        done = sum(1 for r in self.runs if r.status == 'done')
+        lines.append(f"{done}/{len(self.runs)} {self.what} done")
+
+        if self.tty:
+            if self._lines:
+                self.out.write(f"\033[{self._lines}F")
+            for l in lines:
+                self.out.write(f"\033[2K{l}\n")
+            self._lines = len(lines)
+        else:
+            # without a terminal, only report coarse changes
+            for r in self.runs:
+                state = (r.status, int(r.progress * 10))
+                if r.status != 'queued' and self._last.get(r.name) != state:
+                    self.out.write(r.describe() + "\n")
+                    self._last[r.name] = state
+
+        self.out.flush()
+
+    async def run(self):
+        try:
+            while True:
+                self.draw()
+                await asyncio.sleep(self.interval)
+        except asyncio.CancelledError:
+            self.draw()
+            raise
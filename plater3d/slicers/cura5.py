@@ -9,7 +9,9 @@ from urllib.parse import unquote_plus
 import itertools
 import re
 import subprocess
+import hashlib
 from ..xform import Rotation3D
+from ..config import get_cache_dir
 import xml.etree.ElementTree as ET
 
 # the re that matches as setting
@@ -19,6 +21,9 @@ cura_config = namedtuple('cura_config', 'cfg ty')
 
 logger = logging.getLogger(__name__)
 
+# command lines longer than this pass general settings through a -j file
+SETTINGS_JSON_THRESHOLD = 64 * 1024
+
 class FileSettings:
     def __init__(self, filename):
         self.filename = filename
@@ -26,6 +31,9 @@ class FileSettings:
 
     def _load_settings(self):
         out = []
+        with open(self.filename, "rb") as f:
+            self.content_hash = hashlib.sha256(f.read()).hexdigest()
+
         with open(self.filename, "r") as f:
             for l in f:
                 if l[0] == "#": continue
@@ -43,6 +51,10 @@ class FileSettings:
 
         self._settings = out
 
+    def items(self):
+        """The settings as (key, value) pairs, in file order."""
+        return iter(self._settings)
+
     def get_defs(self):
         return {}
 
@@ -91,6 +103,103 @@ class ConfigSettings:
     def get_part_settings(self, partndx):
         return {}
 
+class CompiledSettings:
+    """Settings layers resolved into their final values.
+
+    Later layers override earlier ones, exactly as repeated -s flags
+    would on the CuraEngine command line."""
+
+    VERSION = 1
+
+    def __init__(self, env, defs, general, layers = 0):
+        self.env = env
+        self.defs = defs
+        self.general = general
+        self.layers = layers
+
+    @staticmethod
+    def _cache_key(settings, kvx):
+        hashes = [getattr(s, 'content_hash', None) for s in settings]
+        if None in hashes:
+            return None
+
+        h = hashlib.sha256(f"v{CompiledSettings.VERSION}".encode('utf-8'))
+        h.update(json.dumps([hashes, kvx], sort_keys=True).encode('utf-8'))
+        return h.hexdigest()
+
+    @staticmethod
+    def compile(settings, kvx, cachedir = None):
+        key = CompiledSettings._cache_key(settings, kvx)
+        if key is not None:
+            if cachedir is None:
+                cachedir = get_cache_dir() / 'settings'
+
+            cf = Path(cachedir) / f"{key}.json"
+            if cf.exists():
+                with open(cf, "r") as f:
+                    d = json.load(fp=f)
+                logger.info(f"Using compiled settings from {cf}")
+                return CompiledSettings(d['env'], d['defs'], d['general'], d['layers'])
+
+        env = dict(itertools.chain(*map(lambda x: x.get_env(), settings)))
+
+        defs = []
+        for flag in itertools.chain(*map(lambda x: x.get_defs(), settings)):
+            if flag[1] not in defs:
+                defs.append(flag[1])
+
+        general = dict([(k, str(v)) for k, v in kvx.items()])
+        layers = len(general)
+        for flag in itertools.chain(*map(lambda x: x.get_general_settings(), settings)):
+            k, v = flag[1].split('=', 1)
+            # re-insert so the order reflects where the final value came from
+            general.pop(k, None)
+            general[k] = v
+            layers += 1
+
+        out = CompiledSettings(env, defs, general, layers)
+
+        if key is not None:
+            Path(cachedir).mkdir(parents=True, exist_ok=True)
+            tmp = cf.with_suffix(f'.{os.getpid()}.tmp')
+            with open(tmp, "w") as f:
+                json.dump({'env': env, 'defs': defs, 'general': general, 'layers': layers},
+                          fp=f, indent='  ')
+            os.replace(tmp, cf)
+
+        return out
+
+    def write_definition(self, extra = {}, cachedir = None):
+        """Write the general settings as a definition file for -j.
+
+        The file is named by its contents and kept in the settings cache,
+        so it is shared by plates with the same settings and never left
+        next to the output. Returns its name."""
+
+        # CuraEngine's -j loader only needs default_value for each setting
+        d = {'version': 2,
+             'name': 'pj3d compiled settings',
+             'metadata': {},
+             'settings': {'pj3d': {'label': 'pj3d',
+                                   'type': 'category',
+                                   'children': dict([(k, {'default_value': v})
+                                                     for k, v in itertools.chain(self.general.items(),
+                                                                                 extra.items())])}}}
+
+        data = json.dumps(d, indent='  ')
+        if cachedir is None:
+            cachedir = get_cache_dir() / 'settings'
+
+        filename = Path(cachedir) / f"{hashlib.sha256(data.encode('utf-8')).hexdigest()}.def.json"
+        if not filename.exists():
+            Path(cachedir).mkdir(parents=True, exist_ok=True)
+            tmp = filename.with_suffix(f'.{os.getpid()}.tmp')
+            with open(tmp, "w") as f:
+                f.write(data)
+            os.replace(tmp, filename)
+
+        return filename
+
 class CURA5Config:
     """Locate CURA 5.0 configuration files"""
     def __init__(self, binary, appimage = False):
@@ -309,7 +418,8 @@ class CURA5Config:
 
         return out, defjsons
 
-    def invoke_slicer(self, machine, extruder_ndx, settings, parts, output, dry_run = False, logfile = None):
+    def build_command(self, machine, extruder_ndx, settings, parts, output, settings_json = None,
+                      progress = False):
         if hasattr(self, '_mac2extruders'):
             extruders = self._mac2extruders[machine]
         else:
@@ -319,42 +429,77 @@ class CURA5Config:
         kvx = {'machine_extruder_count': len(extruders),
                'adhesion_extruder_nr': extruder_ndx}
 
+        compiled = CompiledSettings.compile(settings, kvx)
+
         # order matters, later settings take precedence
         cmd = [self.binary, "slice"]
 
-        env = dict(itertools.chain(*map(lambda x: x.get_env(), settings)))
-
         # first definitions
-        for flag in itertools.chain(*map(lambda x: x.get_defs(), settings)):
-            cmd.extend(flag)
-
-        for k, v in kvx.items():
-            cmd.extend(('-s', f'{k}={v}'))
-
-        for flag in itertools.chain(*map(lambda x: x.get_general_settings(), settings)):
-            cmd.extend(flag)
-
+        for d in compiled.defs:
+            cmd.extend(('-j', d))
+
+        general = []
+        for k, v in compiled.general.items():
+            general.extend(('-s', f'{k}={v}'))
+
+        # mesh_rotation_matrix is read from the scope active when -l is seen,
+        # which is the previous mesh; meshes that don't set it inherit the
+        # global value, so only rotations that differ from it are passed
+        mesh = []
+        global_rot = None
         for p in parts:
             if p.rotation is not None:
-                rot = Rotation3D(*p.rotation)
-                cmd.extend(['-s', f'mesh_rotation_matrix={rot.matrix()}'])
+                rot = str(Rotation3D(*p.rotation).matrix())
+                if global_rot is None:
+                    global_rot = rot
+                    general.extend(['-s', f'mesh_rotation_matrix={rot}'])
+                elif rot != global_rot:
+                    mesh.extend(['-s', f'mesh_rotation_matrix={rot}'])
 
-            cmd.extend(['-l', p.filename])
+            mesh.extend(['-l', str(p.filename)])
 
             if p.offset is None:
-                cmd.extend(('-s', 'center_object=True'))
+                mesh.extend(('-s', 'center_object=True'))
             else:
                 for pos, off in zip(('x', 'y', 'z'), p.offset):
                     # absolute pos or offset?
-                    cmd.extend(['-s', f'mesh_position_{pos}={off}'])
+                    mesh.extend(['-s', f'mesh_position_{pos}={off}'])
 
-        cmd.extend(['-o', output, '-v'])
+        tail = ['-o', str(output), '-v']
+        if progress:
+            tail.append('-p')
 
-        print(" ".join([f'{k}={v}' for (k, v) in env.items()]),
-              " ".join(cmd))
+        size = sum(len(x) + 1 for x in itertools.chain(cmd, general, mesh, tail))
+        if settings_json is None:
+            settings_json = size > SETTINGS_JSON_THRESHOLD
+
+        if settings_json:
+            extra = {'mesh_rotation_matrix': global_rot} if global_rot is not None else {}
+            deffile = compiled.write_definition(extra)
+            general = ['-j', str(deffile)]
+
+        cmd = cmd + general + mesh + tail
+        compiled.size = sum(len(x) + 1 for x in cmd)
+        compiled.inline_size = size
+
+        return cmd, compiled
+
+    def invoke_slicer(self, machine, extruder_ndx, settings, parts, output, dry_run = False, logfile = None,
+                      settings_json = None):
+        cmd, compiled = self.build_command(machine, extruder_ndx, settings, parts, output,
+                                           settings_json = settings_json)
+        self.report_command(cmd, compiled)
 
         if not dry_run:
-            subprocess.run(cmd, stdout=logfile, stderr=subprocess.STDOUT, env=env, check=True)
+            subprocess.run(cmd, stdout=logfile, stderr=subprocess.STDOUT, env=compiled.env, check=True)
+
+    def report_command(self, cmd, compiled):
+        print(" ".join([f'{k}={v}' for (k, v) in compiled.env.items()]),
+              " ".join(cmd))
+
+        print(f"Compiled {compiled.layers} settings to {len(compiled.general)}, "
+              f"command line is {compiled.size} bytes in {len(cmd)} arguments"
+              + (f" (inline would be {compiled.inline_size} bytes)" if compiled.size != compiled.inline_size else ""))
 
     def _load_container(self, name, ccfg):
         settings = []
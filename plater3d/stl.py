@@ -0,0 +1,87 @@
+import struct
+from array import array
+
+import numpy as np
+
+BINARY_DTYPE = np.dtype([('normal', '<f4', (3,)),
+                         ('vertices', '<f4', (3, 3)),
+                         ('attr', '<u2')])
+
+def is_binary_stl(filename):
+    with open(filename, "rb") as f:
+        hdr = f.read(84)
+        f.seek(0, 2)
+        size = f.tell()
+
+    if len(hdr) < 84:
+        return False
+
+    n = struct.unpack('<I', hdr[80:84])[0]
+    return size == 84 + n * BINARY_DTYPE.itemsize
+
+def _read_ascii(filename):
+    coords = array('f')
+    with open(filename, "rb") as f:
+        for l in f:
+            l = l.strip()
+            if l.startswith(b'vertex'):
+                coords.extend(map(float, l.split()[1:4]))
+
+    return np.frombuffer(coords, dtype=np.float32).reshape(-1, 3, 3)
+
+def read_stl(filename):
+    """Return the triangles of an ASCII or binary STL as an (N, 3, 3) array."""
+
+    if is_binary_stl(filename):
+        data = np.fromfile(filename, dtype=BINARY_DTYPE, offset=84)
+        return np.ascontiguousarray(data['vertices'])
+
+    return _read_ascii(filename)
+
+def face_normals(tris):
+    n = np.cross(tris[:, 1] - tris[:, 0], tris[:, 2] - tris[:, 0])
+    l = np.linalg.norm(n, axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(l[:, None] > 0, n / l[:, None], 0), l / 2
+
+def write_binary_stl(filename, tris, header = b'plater3d'):
+    data = np.zeros(len(tris), dtype=BINARY_DTYPE)
+    data['vertices'] = tris
+    data['normal'] = face_normals(tris.astype(np.float64))[0]
+
+    with open(filename, "wb") as f:
+        f.write(header[:80].ljust(80, b' '))
+        f.write(struct.pack('<I', len(tris)))
+        data.tofile(f)
+
+def repair(tris, eps = 1e-12):
+    """Drop non-finite, zero-area and duplicate facets.
+
+    A duplicate has the same vertices in the same winding, a facet and
+    its reversed twin are both kept so that orientation isn't changed."""
+
+    tris = tris[np.all(np.isfinite(tris), axis=(1, 2))]
+    _, area = face_normals(tris.astype(np.float64))
+    tris = tris[area > eps]
+    if len(tris) == 0:
+        return tris
+
+    # number the vertices and rotate each facet to start at its lowest,
+    # which keeps the winding
+    verts = np.ascontiguousarray(tris.reshape(-1, 3)).view(np.dtype((np.void, 12)))
+    _, ids = np.unique(verts, return_inverse=True)
+    ids = ids.reshape(-1, 3)
+    first = np.argmin(ids, axis=1)
+    rows = np.arange(len(ids))[:, None]
+    key = ids[rows, (first[:, None] + np.arange(3)) % 3]
+
+    _, keep = np.unique(key, axis=0, return_index=True)
+    return tris[np.sort(keep)]
+
+def decimate(tris, tolerance):
+    """Vertex-clustering decimation: snap vertices to a grid of size tolerance
+    and drop facets that collapse."""
+
+    lo = tris.reshape(-1, 3).min(axis=0)
+    snapped = np.round((tris - lo) / tolerance) * tolerance + lo
+    return repair(snapped.astype(np.float32))
@@ -0,0 +1,117 @@
+import os
+import sys
+import time
+import ctypes
+import ctypes.util
+import select
+import struct
+import logging
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# from <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+_event = struct.Struct('iIII')
+
+class PollingWatcher:
+    """Reports changes to a set of files by comparing mtime and size."""
+
+    def __init__(self, files, interval = 1.0):
+        self.files = dict([(str(Path(f).resolve()), f) for f in files])
+        self.interval = interval
+        self._stamps = dict([(f, self._stamp(f)) for f in self.files])
+
+    def _stamp(self, f):
+        try:
+            st = os.stat(f)
+            return (st.st_mtime_ns, st.st_size)
+        except FileNotFoundError:
+            return None
+
+    def wait(self, timeout):
+        """Return the files that changed within timeout seconds."""
+
+        deadline = time.monotonic() + timeout
+        while True:
+            changed = set()
+            for f, orig in self.files.items():
+                s = self._stamp(f)
+                if s != self._stamps[f]:
+                    self._stamps[f] = s
+                    changed.add(orig)
+
+            left = deadline - time.monotonic()
+            if changed or left <= 0:
+                return changed
+
+            time.sleep(min(self.interval, left))
+
+    def close(self):
+        pass
+
+class InotifyWatcher:
+    """Reports changes to a set of files using inotify on their directories.
+
+    Watching the directories catches editors and exporters that write a
+    new file and rename it over the old one."""
+
+    def __init__(self, files):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.files = dict([(str(Path(f).resolve()), f) for f in files])
+
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+        self._dirs = {}
+        mask = IN_CLOSE_WRITE | IN_MOVED_TO | IN_MOVED_FROM | IN_CREATE | IN_DELETE
+        for d in set(str(Path(f).parent) for f in self.files):
+            wd = libc.inotify_add_watch(self.fd, os.fsencode(d), mask)
+            if wd < 0:
+                os.close(self.fd)
+                raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {d}")
+            self._dirs[wd] = d
+
+    def wait(self, timeout):
+        r, _, _ = select.select([self.fd], [], [], timeout)
+        if not r:
+            return set()
+
+        changed = set()
+        try:
+            buf = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return changed
+
+        pos = 0
+        while pos + _event.size <= len(buf):
+            wd, mask, cookie, length = _event.unpack_from(buf, pos)
+            name = buf[pos + _event.size:pos + _event.size + length].rstrip(b'\0')
+            pos += _event.size + length
+
+            if wd in self._dirs and name:
+                f = os.path.join(self._dirs[wd], os.fsdecode(name))
+                if f in self.files:
+                    changed.add(self.files[f])
+
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+def make_watcher(files, interval = 1.0, polling = False):
+    if not polling and sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(files)
+        except (OSError, AttributeError) as e:
+            logger.warning(f"inotify unavailable ({e}), polling instead")
+
+    return PollingWatcher(files, interval)
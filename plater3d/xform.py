@@ -1,4 +1,7 @@
 import math
+from functools import lru_cache
+
+import numpy as np
 
 class Rotation3D:
     def __init__(self, rotx = 0, roty = 0, rotz = 0):
@@ -41,6 +44,174 @@ class Rotation3D:
 
         return self._mm(rotz, self._mm(roty, rotx))
 
+    @staticmethod
+    def batch(angles):
+        """Matrices for many (rotx, roty, rotz) triples at once, as an
+        (N, 3, 3) array matching matrix() for each triple."""
+
+        a = np.radians(np.asarray(angles, dtype=float).reshape(-1, 3))
+        c = np.round(np.cos(a), 6)
+        s = np.round(np.sin(a), 6)
+        one = np.ones(len(a))
+        zero = np.zeros(len(a))
+
+        rx = np.stack([one, zero, zero,
+                       zero, c[:, 0], -s[:, 0],
+                       zero, s[:, 0], c[:, 0]], axis=1).reshape(-1, 3, 3)
+        ry = np.stack([c[:, 1], zero, s[:, 1],
+                       zero, one, zero,
+                       -s[:, 1], zero, c[:, 1]], axis=1).reshape(-1, 3, 3)
+        rz = np.stack([c[:, 2], -s[:, 2], zero,
+                       s[:, 2], c[:, 2], zero,
+                       zero, zero, one], axis=1).reshape(-1, 3, 3)
+
+        return rz @ ry @ rx
+
+    def array(self):
+        return Rotation3D.batch([(self.rotx, self.roty, self.rotz)])[0]
+
+class Affine:
+    """A 3D affine transform stored as a 4x4 matrix.
+
+    a @ b is the transform that applies b first, then a."""
+
+    def __init__(self, matrix = None):
+        self.m = np.eye(4) if matrix is None else np.asarray(matrix, dtype=float)
+
+    @staticmethod
+    def translation(t):
+        m = np.eye(4)
+        m[:len(t), 3] = t
+        return Affine(m)
+
+    @staticmethod
+    def rotation(angles):
+        m = np.eye(4)
+        m[:3, :3] = Rotation3D.batch([angles])[0]
+        return Affine(m)
+
+    @staticmethod
+    def scale(s):
+        m = np.eye(4)
+        m[0, 0], m[1, 1], m[2, 2] = np.broadcast_to(s, 3)
+        return Affine(m)
+
+    def __matmul__(self, other):
+        return Affine(self.m @ other.m)
+
+    def then(self, other):
+        return other @ self
+
+    def inverse(self):
+        return Affine(np.linalg.inv(self.m))
+
+    @property
+    def linear(self):
+        return self.m[:3, :3]
+
+    @property
+    def offset(self):
+        return self.m[:3, 3]
+
+    def apply(self, points):
+        """Transform an (..., 3) or (..., 2) array of points; 2D points are
+        taken to lie on z = 0."""
+
+        p = np.asarray(points, dtype=float)
+        if p.shape[-1] == 2:
+            return p @ self.m[:2, :2].T + self.m[:2, 3]
+
+        return p @ self.linear.T + self.offset
+
+    def apply_polygons(self, polys):
+        # concatenate so many small polygons are transformed in one call
+        if not len(polys): return []
+
+        lens = [len(p) for p in polys]
+        out = self.apply(np.concatenate([np.asarray(p, dtype=float) for p in polys]))
+        return np.split(out, np.cumsum(lens)[:-1])
+
+def apply_batch(matrices, points):
+    """Apply N 4x4 matrices to an (M, 3) array, giving (N, M, 3)."""
+
+    m = np.asarray(matrices)
+    return np.einsum('nij,mj->nmi', m[:, :3, :3], points) + m[:, None, :3, 3]
+
+class PlateCoords:
+    """Coordinate mapping shared by packing, slicing and rendering.
+
+    mesh:  the coordinates in the (possibly rotated) STL file
+    plate: origin at the front left corner of the bed, the packer's frame
+    cura:  CuraEngine's frame, where 0,0 is the centre of the bed"""
+
+    def __init__(self, volxyz):
+        self.volxyz = tuple(volxyz)
+
+    @property
+    def plate_to_cura(self):
+        # for some reason, cura aligns 0,0 of the plate to be in the center
+        return _translation((-(self.volxyz[0]//2), -(self.volxyz[1]//2), 0))
+
+    def mesh_to_plate(self, min_point, position, rotation = None):
+        """Place a mesh so the minimum corner of its rotated bounds sits at
+        position (x, y) on the plate, on the bed."""
+
+        return _mesh_to_plate(tuple(min_point), tuple(position[:2]),
+                              tuple(rotation) if rotation is not None and any(rotation) else None)
+
+    def mesh_to_cura(self, min_point, position, rotation = None):
+        return self.plate_to_cura @ self.mesh_to_plate(min_point, position, rotation)
+
+    def plate_offsets(self, min_points, positions):
+        """Translations (after rotation) from mesh to plate for many parts, (N, 3)."""
+
+        mp = np.asarray(min_points, dtype=float).reshape(-1, 3)
+        pos = np.asarray(positions, dtype=float).reshape(-1, 2)
+        return np.column_stack([pos - mp[:, :2], -mp[:, 2]])
+
+    def cura_offsets(self, min_points, positions):
+        return self.plate_offsets(min_points, positions) + self.plate_to_cura.offset
+
+    def placement(self, stlinfo, part):
+        """min_point and rotation of a packed part, including any turn
+        about z that the packer gave it (part['rotz'])."""
+
+        rotz = part.get('rotz', 0)
+        if not rotz:
+            return stlinfo['min_point'], stlinfo.get('rotation', None)
+
+        rotation = list(stlinfo.get('rotation', None) or [0, 0, 0])
+        rotation.extend([0] * (3 - len(rotation)))
+        rotation[2] = (rotation[2] + rotz) % 360
+        return turned_min_point(stlinfo['min_point'], stlinfo['dimensions'], rotz), rotation
+
+    def part_to_plate(self, stlinfo, part):
+        min_point, rotation = self.placement(stlinfo, part)
+        return self.mesh_to_plate(min_point, part['position'], rotation)
+
+def turned_min_point(min_point, dimensions, rotz):
+    """Minimum corner of a part's bounds after turning it rotz degrees
+    (a multiple of 90) about z."""
+
+    lo = np.asarray(min_point, dtype=float)
+    corners = np.array([lo, lo + np.asarray(dimensions, dtype=float)])
+    return [float(x) for x in _rotation((0, 0, rotz)).apply(corners).min(axis=0)]
+
+@lru_cache(maxsize=4096)
+def _translation(t):
+    return Affine.translation(t)
+
+@lru_cache(maxsize=4096)
+def _rotation(angles):
+    return Affine.rotation(angles)
+
+@lru_cache(maxsize=65536)
+def _mesh_to_plate(min_point, position, rotation):
+    t = _translation((position[0] - min_point[0], position[1] - min_point[1], -min_point[2]))
+    if rotation is None:
+        return t
+
+    return t @ _rotation(rotation)
 
 if __name__ == "__main__":
     r = Rotation3D(0, 0, 0)
@@ -0,0 +1,58 @@
+from plater3d import gcodeextract
+
+# two objects on two layers, each path starting with an unretract and
+# ending with a retraction, as CuraEngine writes them
+GCODE = """;FLAVOR:Marlin
+;TIME:100
+;Filament used: 0.01m
+;Layer height: 0.2
+;MINX:0
+;MAXX:20
+;Generated with Cura_SteamEngine 5.0
+M82
+G92 E0
+G1 F1500 E-6.5
+;LAYER_COUNT:2
+;LAYER:0
+G0 F9000 X0 Y0 Z0.2
+;MESH:a.stl
+G0 F9000 X0 Y0
+G1 F1500 E0
+G1 F1200 X10 Y0 E1
+G1 F1500 E-5.5
+;MESH:b.stl
+G0 F9000 X20 Y0
+G1 F1500 E1
+G1 F1200 X30 Y0 E2
+G1 F1500 E-4.5
+;TIME_ELAPSED:50
+;LAYER:1
+G0 F9000 X0 Y0 Z0.4
+;MESH:a.stl
+G0 F9000 X0 Y0
+G1 F1500 E2
+G1 F1200 X10 Y0 E3
+G1 F1500 E-3.5
+;MESH:b.stl
+G0 F9000 X20 Y0
+G1 F1500 E3
+G1 F1200 X30 Y0 E4
+G1 F1500 E-2.5
+;TIME_ELAPSED:100
+M104 S0
+"""
+
+def test_filament_ignores_retractions(tmp_path):
+    src = tmp_path / "plate.0.gcode"
+    src.write_text(GCODE)
+
+    st = gcodeextract.MachineState()
+    for l in GCODE.splitlines():
+        st.update(l)
+    assert st.filament == 4.0
+
+    out = tmp_path / "redo.gcode"
+    r = gcodeextract.extract_objects(src, out, ['a.stl'])
+    assert r['objects'] == ['a.stl']
+    assert abs(r['filament'] - 0.002) < 1e-9
+    assert ";Filament used: 0.00200m\n" in out.read_text()
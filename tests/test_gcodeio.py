@@ -0,0 +1,61 @@
+import gzip
+
+from plater3d import gcodeio
+
+GCODE = """;FLAVOR:Marlin
+;TIME:100
+;Filament used: 0.01m
+;Generated with Cura_SteamEngine 5.0
+M82 ;absolute extrusion mode
+G92 E0
+;LAYER_COUNT:2
+;LAYER:0
+;TYPE:WALL-OUTER
+;MESH:0_part.stl
+G0 F9000 X10.5 Y20 Z0.2
+G1 F1200 X30 Y20 E1.25 ; a comment
+;TIME_ELAPSED:50.5
+;LAYER:1
+;MESH:1_other part.stl
+G1 X30 Y40 E2.5
+M104 S0
+;TIME_ELAPSED:100
+"""
+
+def decoded(stored):
+    with gcodeio.open_gcode(stored) as f:
+        return f.read()
+
+def commands(text):
+    return [l.split(';', 1)[0].strip() for l in text.splitlines() if l.split(';', 1)[0].strip()]
+
+def markers(text):
+    return [l for l in text.splitlines() if l.startswith(gcodeio.KEEP_COMMENTS)]
+
+def test_meatpack_round_trip(tmp_path):
+    for compress in [None, 'gzip']:
+        src = tmp_path / "plate.0.gcode"
+        src.write_text(GCODE)
+
+        stored = gcodeio.encode(src, compress = compress, meatpack = True)
+        assert stored.name == "plate.0.gcode.mpk" + (".gz" if compress else "")
+        assert not src.exists()
+
+        text = decoded(stored)
+        assert commands(text) == commands(GCODE)
+        assert markers(text) == markers(GCODE)
+        # the header is kept as it is
+        assert text.startswith(GCODE[:GCODE.index('M82')])
+
+        # and the body is packed
+        raw = gzip.open(stored).read() if compress else stored.read_bytes()
+        assert b'G1 F1200 X30' not in raw
+
+def test_encode_with_fixup(tmp_path):
+    src = tmp_path / "plate.0.gcode.partial"
+    src.write_text(GCODE.replace(";MESH:", ";MESH:/tmp/x/"))
+
+    stored = gcodeio.encode(tmp_path / "plate.0.gcode", compress = 'gzip', source = src,
+                            fixup = lambda l: l.replace(";MESH:/tmp/x/", ";MESH:"))
+    assert not src.exists()
+    assert decoded(stored) == GCODE
@@ -0,0 +1,110 @@
+from collections import namedtuple
+
+from plater3d.packcache import PackingCache, canonical_order, sizes, to_slots, from_slots
+
+Rect = namedtuple('Rect', 'key x y z part')
+
+def make_rects(names, dims):
+    return [Rect(key=(n, i), x=x, y=y, z=10, part=None) for (n, i), (x, y) in zip(names, dims)]
+
+def fake_pack(rects, groupno):
+    """Lay the rectangles out in a row the way packing_to_plate reports
+    them, turning the square ones so rotz is covered too."""
+
+    plate = {'parts': [], 'bounds': [0, 0, 200, 200]}
+    x = 0
+    for r in rects:
+        p = {'name': r.key[0], 'index': r.key[1], 'group': groupno,
+             'position': [x, 5, r.x, r.y]}
+        if r.x == r.y:
+            p['rotz'] = 90
+        plate['parts'].append(p)
+        x += r.x
+
+    return [plate]
+
+def by_size(plates):
+    """Position, rotation and group for each part, indexed by its size."""
+
+    out = {}
+    for plate in plates:
+        for p in plate['parts']:
+            out.setdefault(tuple(p['position'][2:]), []).append(
+                (p['position'], p.get('rotz', 0), p['group']))
+
+    return dict((k, sorted(v)) for k, v in out.items())
+
+def positions(plates):
+    return dict(((p['name'], p['index']), p['position']) for plate in plates for p in plate['parts'])
+
+DIMS = [(30, 20), (40, 40), (30, 20), (10, 50)]
+
+def test_group_slots_map_onto_other_names(tmp_path):
+    rects_a = canonical_order(make_rects([('a.stl', 0), ('b.stl', 0), ('a.stl', 1), ('c.stl', 0)], DIMS))
+
+    # same sizes, different names and input order
+    dims_b = [DIMS[3], DIMS[2], DIMS[1], DIMS[0]]
+    rects_b = canonical_order(make_rects([('z.stl', 0), ('y.stl', 0), ('x.stl', 0), ('y.stl', 1)], dims_b))
+
+    params = {'volxyz': [200, 200, 200], 'border': 2}
+    assert sizes(rects_a) == sizes(rects_b)
+    assert PackingCache.key('group', params, sizes(rects_a)) == PackingCache.key('group', params, sizes(rects_b))
+
+    packed = fake_pack(rects_a, 3)
+    cache = PackingCache(tmp_path)
+    key = cache.key('group', params, sizes(rects_a))
+    cache.put(key, to_slots(packed, rects_a))
+
+    hit = cache.get(key)
+    assert hit is not None
+
+    # stored without names, so the entry is independent of the job
+    assert all('name' not in p and 'group' not in p for p in hit[0]['parts'])
+
+    plates = from_slots(hit, rects_b, 5)
+    assert by_size(plates) == dict((k, [(pos, rot, 5) for pos, rot, _ in v])
+                                   for k, v in by_size(packed).items())
+
+    # every part of the new job is placed exactly once, on its own size
+    pos = positions(plates)
+    assert sorted(pos) == sorted(r.key for r in rects_b)
+    for r in rects_b:
+        assert pos[r.key][2:] == [r.x, r.y]
+
+    # and the original job maps back onto itself
+    assert from_slots(hit, rects_a, 3) == packed
+
+def test_job_slots_keep_groups_and_extra_parts(tmp_path):
+    group_a = [canonical_order(make_rects([('a.stl', 0), ('b.stl', 0)], DIMS[:2])),
+               canonical_order(make_rects([('c.stl', 0), ('d.stl', 0)], DIMS[2:]))]
+    group_b = [canonical_order(make_rects([('q.stl', 1), ('p.stl', 0)], DIMS[:2])),
+               canonical_order(make_rects([('s.stl', 0), ('r.stl', 0)], DIMS[2:]))]
+
+    packed = []
+    for groupno, g in enumerate(group_a):
+        packed.extend(fake_pack(g, groupno))
+
+    # a purge line is not one of the rectangles and keeps its identity
+    purge = {'name': 'purge.stl', 'index': 0, 'group': 0, 'position': [150, 150, 20, 2]}
+    packed[0]['parts'].append(purge)
+
+    allrects_a = [r for g in group_a for r in g]
+    allrects_b = [r for g in group_b for r in g]
+
+    cache = PackingCache(tmp_path)
+    key = cache.key('job', {}, [sizes(g) for g in group_a])
+    assert key == cache.key('job', {}, [sizes(g) for g in group_b])
+    cache.put(key, to_slots(packed, allrects_a, keep_group = True))
+
+    plates = from_slots(cache.get(key), allrects_b)
+    assert [p['group'] for p in plates[0]['parts']] == [0, 0, 0]
+    assert [p['group'] for p in plates[1]['parts']] == [1, 1]
+    assert plates[0]['parts'][-1] == purge
+
+    pos = positions(plates)
+    for groupno, g in enumerate(group_b):
+        for r in g:
+            assert pos[r.key][2:] == [r.x, r.y]
+            assert r.key in [(p['name'], p['index']) for p in plates[groupno]['parts']]
+
+    assert from_slots(cache.get(key), allrects_a) == packed